@@ -0,0 +1,253 @@
+# coding=utf-8
+# Benchmarks for the line converters and the end-to-end conversion pipeline.
+#
+# Example:
+#     python3 benchmark_parsebankstatement.py --sizes 10000 1000000 --output bench.json
+#
+# Results are written as JSON so runs of different versions can be compared.
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import parsebankstatement
+from parsebankstatement import DATE_CACHE
+from parsebankstatement import FileReader
+from parsebankstatement import FileWriter
+from parsebankstatement import GeneralLineConverter
+from parsebankstatement import StatementConverter
+
+BANKS = ["santander", "skandia", "ica", "ica2"]
+DEFAULT_SIZES = [10000, 1000000, 10000000]
+DEFAULT_LINE_COUNT = 20000
+DEFAULT_STARTUP_RUNS = 5
+DEFAULT_MAX_STARTUP_SLOWDOWN = 0.1
+STARTUP_LINE_COUNT = 10
+STARTUP_TOP_IMPORTS = 10
+MONTH_STRINGS = ["jan", "feb", "mar", "apr", "maj", "jun", "jul", "aug", "sep", "okt", "nov", "dec"]
+PAYEES = ["ITUNES.COM/BILL", "CAFE LUNDBY, GOTEBORG", "HERTZ SWEDEN FRANCHI", "Tåg varberg",
+          "INET RINGÖN, GÖTEBORG", "BLOMSTERLANDET I BORÅS, BORÅS", "Från Skandia", "INBETALNING - PG OCR"]
+PARSE_METHODS = ["parse_date", "parse_payee", "parse_transaction", "parse_outflow", "parse_inflow"]
+
+
+def format_amount(random_generator):
+    amount = random_generator.randint(-2000000, 2000000)
+    sign = "-" if amount < 0 else ""
+    kronor, ore = divmod(abs(amount), 100)
+    kronor_string = "{:,}".format(kronor).replace(",", " ")
+    return "{}{},{:02d}".format(sign, kronor_string, ore)
+
+
+def generate_line(bank, random_generator):
+    year = random_generator.randint(2016, 2021)
+    month = random_generator.randint(1, 12)
+    day = random_generator.randint(1, 28)
+    iso_date = "{}-{:02d}-{:02d}".format(year, month, day)
+    payee = random_generator.choice(PAYEES)
+    amount = format_amount(random_generator)
+    balance = format_amount(random_generator)
+    if "santander" == bank:
+        return "{} \t{} \t{} \t0 \t{} kr \t{} kr\n".format(iso_date, iso_date, payee, amount, balance)
+    if "skandia" == bank:
+        return "{} \t{} {} \t{} \t{}\n".format(iso_date, iso_date, payee, amount, balance)
+    if "ica" == bank:
+        return "{} \t{} \tKorttransaktion \tÖvrigt \t{} kr \t{} kr\n".format(iso_date, payee, amount, balance)
+    if "ica2" == bank:
+        month_date = "{:02d} {} {}".format(day, MONTH_STRINGS[month - 1], year)
+        return "{}\t{}\tKorttransaktion\tÖvrigt\t{} kr\t{} kr\n".format(month_date, payee, amount, balance)
+    raise Exception("Invalid bank" + bank)
+
+
+def generate_lines(bank, line_count, seed=0):
+    random_generator = random.Random(seed)
+    return [generate_line(bank, random_generator) for _ in range(line_count)]
+
+
+def write_statement_file(file_name, bank, line_count, seed=0):
+    random_generator = random.Random(seed)
+    with open(file_name, 'w') as f_output:
+        for _ in range(line_count):
+            f_output.write(generate_line(bank, random_generator))
+
+
+def time_calls(function, arguments):
+    start = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    elapsed = time.perf_counter() - start
+    return {"calls": len(arguments), "seconds": elapsed, "ns_per_call": elapsed * 1e9 / max(len(arguments), 1)}
+
+
+def benchmark_line_converters(line_count):
+    results = {}
+    for bank in BANKS:
+        lines = generate_lines(bank, line_count)
+        line_converter = GeneralLineConverter(bank)
+        bank_results = {}
+
+        DATE_CACHE.clear()
+        bank_results["convert_line"] = time_calls(line_converter.convert_line, lines)
+        for method in PARSE_METHODS:
+            bank_results[method] = time_calls(getattr(line_converter, method), lines)
+
+        raw_dates = [line_converter._parse_year_month_day(line) for line in lines]
+        DATE_CACHE.clear()
+        bank_results["convert_date_cached"] = time_calls(line_converter._convert_date_string, raw_dates)
+        bank_results["convert_date_uncached"] = time_calls(line_converter._convert_date_string_uncached, raw_dates)
+        bank_results["date_cache"] = DATE_CACHE.info()
+        results[bank] = bank_results
+    return results
+
+
+def benchmark_end_to_end(sizes, bank, directory):
+    results = {}
+    for size in sizes:
+        input_file = os.path.join(directory, "statement_{}.txt".format(size))
+        output_file = os.path.join(directory, "statement_{}.csv".format(size))
+        write_statement_file(input_file, bank, size)
+
+        DATE_CACHE.clear()
+        statement_converter = StatementConverter(GeneralLineConverter(bank), FileReader(input_file),
+                                                 FileWriter(output_file), StatementConverter.DEFAULT_BATCH_SIZE)
+        start = time.perf_counter()
+        statement_converter.convert()
+        del statement_converter  # close the output file before timing stops
+        elapsed = time.perf_counter() - start
+
+        results[str(size)] = {"lines": size, "seconds": elapsed, "lines_per_second": size / elapsed,
+                              "input_bytes": os.path.getsize(input_file)}
+        os.remove(input_file)
+        os.remove(output_file)
+    return results
+
+
+def parse_import_times(stderr):
+    # Lines look like "import time:      2627 |      21348 | parsebankstatement"
+    import_times = []
+    for line in stderr.splitlines():
+        fields = line.split("|")
+        if 3 != len(fields) or not line.startswith("import time:"):
+            continue
+        cumulative = fields[1].strip()
+        if cumulative.isdigit():
+            import_times.append((int(cumulative), fields[2].strip()))
+    return import_times
+
+
+def time_process(command, cwd=None):
+    # Bytecode is cached as on a default installation, even when the benchmark itself runs without
+    environment = dict(os.environ)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    start = time.perf_counter()
+    completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               universal_newlines=True, check=True, env=environment, cwd=cwd)
+    return time.perf_counter() - start, completed.stderr
+
+
+def time_cli(script, bank, input_file, directory, runs):
+    cli_seconds = []
+    for run in range(runs + 1):
+        output_file = os.path.join(directory, "startup_{}.csv".format(run))
+        elapsed, _ = time_process([sys.executable, script, bank, input_file, "--output_file", output_file])
+        os.remove(output_file)
+        if run > 0:  # The first run fills the bytecode cache
+            cli_seconds.append(elapsed)
+    return statistics.median(cli_seconds)
+
+
+def benchmark_startup(runs, bank, directory, baseline_script=None):
+    module_directory = os.path.dirname(os.path.abspath(parsebankstatement.__file__))
+    launcher = os.path.join(module_directory, "parsebankstatement_cli.py")
+    script = os.path.join(module_directory, "parsebankstatement.py")
+    input_file = os.path.join(directory, "startup.txt")
+    write_statement_file(input_file, bank, STARTUP_LINE_COUNT)
+
+    import_seconds = []
+    import_times = []
+    for run in range(runs):
+        elapsed, stderr = time_process([sys.executable, "-X", "importtime", "-c", "import parsebankstatement"],
+                                       module_directory)
+        import_seconds.append(elapsed)
+        import_times = parse_import_times(stderr)
+
+    results = {"runs": runs, "import_seconds_median": statistics.median(import_seconds),
+               "cli_seconds_median": time_cli(launcher, bank, input_file, directory, runs),
+               "script_seconds_median": time_cli(script, bank, input_file, directory, runs)}
+    if None != baseline_script:
+        results["baseline_cli_seconds_median"] = time_cli(baseline_script, bank, input_file, directory, runs)
+    os.remove(input_file)
+
+    top_imports = sorted(import_times, reverse=True)[:STARTUP_TOP_IMPORTS]
+    results["top_imports_us"] = [{"module": name, "cumulative_us": us} for us, name in top_imports]
+    return results
+
+
+def check_startup(startup, max_slowdown):
+    # Error message when the cli starts slower than the baseline script, None otherwise
+    baseline = startup.get("baseline_cli_seconds_median")
+    if None == baseline or startup["cli_seconds_median"] <= baseline * (1 + max_slowdown):
+        return None
+    return "cli start {:.1f} ms is more than {:.0%} slower than the baseline {:.1f} ms".format(
+        startup["cli_seconds_median"] * 1000, max_slowdown, baseline * 1000)
+
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='*', default=DEFAULT_SIZES,
+                        help="line counts for the end-to-end benchmark (default: 10k 1M 10M)")
+    parser.add_argument("--bank", default="santander", help="bank format used for the end-to-end benchmark")
+    parser.add_argument("--lines", type=int, default=DEFAULT_LINE_COUNT,
+                        help="lines per bank for the per-method benchmarks (default: {})".format(DEFAULT_LINE_COUNT))
+    parser.add_argument("--startup_runs", type=int, default=DEFAULT_STARTUP_RUNS,
+                        help="interpreter starts for the startup benchmark, 0 to skip (default: {})".format(
+                            DEFAULT_STARTUP_RUNS))
+    parser.add_argument("--baseline_script", default=None,
+                        help="parsebankstatement.py of an earlier version, e.g. from git show, fail when the cli "
+                             "starts slower than it")
+    parser.add_argument("--max_startup_slowdown", type=float, default=DEFAULT_MAX_STARTUP_SLOWDOWN,
+                        help="allowed cli start slowdown against --baseline_script (default: {})".format(
+                            DEFAULT_MAX_STARTUP_SLOWDOWN))
+    parser.add_argument("--output", default=None, help="json result file (default: stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_command_line_arguments()
+
+    directory = tempfile.mkdtemp()
+    try:
+        results = {
+            "python": sys.version,
+            "platform": platform.platform(),
+            "module": os.path.abspath(parsebankstatement.__file__),
+            "line_converters": benchmark_line_converters(args.lines),
+            "end_to_end": benchmark_end_to_end(args.sizes, args.bank, directory),
+        }
+        if 0 < args.startup_runs:
+            results["startup"] = benchmark_startup(args.startup_runs, args.bank, directory, args.baseline_script)
+    finally:
+        shutil.rmtree(directory)
+
+    if None == args.output:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, 'w') as f_output:
+            json.dump(results, f_output, indent=2)
+
+    startup_error = None
+    if "startup" in results:
+        startup_error = check_startup(results["startup"], args.max_startup_slowdown)
+    if None != startup_error:
+        sys.exit(startup_error)
+
+
+if __name__ == '__main__':
+    main()
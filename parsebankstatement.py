@@ -1,9 +1,22 @@
 # coding=utf-8
 # see: https://www.python.org/dev/peps/pep-0263/
-import argparse
 import re
 import time
 import os.path
+import io
+import sys
+from array import array
+from collections import Counter, OrderedDict, namedtuple
+from itertools import islice
+
+# Only needed by some modes, imported on first use to keep the cli start fast:
+# argparse, asyncio, concurrent.futures, glob, hashlib, json, locale, mmap, shutil, sqlite3, urllib.parse, pyarrow
+pyarrow = None
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+STDIO_FILE_NAME = "-"  # Input from stdin or output to stdout
+# Part of every result cache key, bump whenever the converted output can change
+CONVERTER_VERSION = "1"
 
 
 class ErrorInputLineEndsWithCsv(Exception):
@@ -18,13 +31,89 @@ class ErrorOutputFileAlreadyExists(Exception):
         self.message = message
 
 
-class FileReader:
+class ErrorTooManyRejectedLines(Exception):
+
+    def __init__(self, message):
+        self.message = message
+
 
-    def __init__(cls, file_name):
-        cls.f_input = open(file_name, 'r')
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".xz": "xz", ".bz2": "bz2", ".zst": "zstd"}
+COMPRESSION_MAGIC = {b"\x1f\x8b": "gzip", b"\xfd7zXZ\x00": "xz", b"BZh": "bz2", b"\x28\xb5\x2f\xfd": "zstd"}
+GZIP_COMPRESS_LEVEL = 6  # Same as the gzip tool, level 9 is several times slower for a few percent
+
+
+def detect_compression(magic):
+    for prefix, compression in COMPRESSION_MAGIC.items():
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+
+def compression_from_file_name(file_name):
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(file_name)[1].lower())
+
+
+def sniff_compression(file_name):
+    if STDIO_FILE_NAME == file_name:
+        return None  # Only known once FileReader peeks at the stream
+    with open(file_name, 'rb') as f_input:
+        return detect_compression(f_input.read(6))
+
+
+def open_compressed(f_binary, mode, compression):
+    # Streaming (de)compressor on an open binary file, the caller still closes f_binary
+    if "gzip" == compression:
+        import gzip
+        return gzip.GzipFile(fileobj=f_binary, mode=mode, compresslevel=GZIP_COMPRESS_LEVEL)
+    if "bz2" == compression:
+        import bz2
+        return bz2.BZ2File(f_binary, mode)
+    if "xz" == compression:
+        import lzma
+        return lzma.LZMAFile(f_binary, mode)
+    if "zstd" == compression:
+        try:
+            from compression import zstd  # Python 3.14+
+            return zstd.ZstdFile(f_binary, mode)
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("zstd compression needs Python 3.14 or the zstandard package")
+        if mode.startswith('r'):
+            return zstandard.ZstdDecompressor().stream_reader(f_binary, read_across_frames=True, closefd=False)
+        return zstandard.ZstdCompressor().stream_writer(f_binary, closefd=False)
+    raise Exception("Invalid compression: {}".format(compression))
+
+
+class FileReader:
+    # Reads lines from a file or stdin, decompressing gzip, xz, bz2 and zstd; seekable keeps tell() and seek() working
+
+    def __init__(cls, file_name, buffer_size=-1, seekable=False):
+        cls.file_name = file_name
+        cls.seekable = seekable
+        if buffer_size == 0:
+            buffer_size = -1  # Detecting the compression needs a buffered reader to peek into
+        if STDIO_FILE_NAME == file_name:
+            # Own buffered reader on the descriptor, closing it leaves sys.stdin usable
+            cls.f_binary = open(sys.stdin.fileno(), 'rb', buffering=buffer_size, closefd=False)
+        else:
+            cls.f_binary = open(file_name, 'rb', buffering=buffer_size)
+        cls.compression = detect_compression(cls.f_binary.peek(6)[:6])
+        if None == cls.compression:
+            cls.f_input = io.TextIOWrapper(cls.f_binary)
+        else:
+            read_size = buffer_size if buffer_size > 0 else DEFAULT_BUFFER_SIZE
+            decompressed = io.BufferedReader(open_compressed(cls.f_binary, 'rb', cls.compression), read_size)
+            cls.f_input = io.TextIOWrapper(decompressed)
+        cls.encoding = cls.f_input.encoding
 
     def __del__(cls):
-        cls.f_input.close()
+        if hasattr(cls, 'f_input'):
+            cls.f_input.close()
+        if hasattr(cls, 'f_binary'):
+            cls.f_binary.close()
 
     def read_line(cls):
         line = cls.f_input.readline()
@@ -32,6 +121,18 @@ class FileReader:
             return None
         return line
 
+    def read_lines(cls, count):
+        if cls.seekable:
+            # Iterating the text file itself would disable tell()
+            return list(islice(iter(cls.f_input.readline, ""), count))
+        return list(islice(cls.f_input, count))
+
+    def tell(cls):
+        return cls.f_input.tell()
+
+    def seek(cls, offset):
+        cls.f_input.seek(offset)
+
     def __iter__(cls):
         return cls
 
@@ -42,24 +143,273 @@ class FileReader:
         return line
 
 
-class FileWriter:
+def decode_lines(data, encoding):
+    text = data.decode(encoding)
+    if '\r' in text:
+        # Same universal newline translation as a file opened in text mode
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = [line + '\n' for line in text.split('\n')]
+    last_line = lines.pop()
+    if len(last_line) > 1:
+        lines.append(last_line[:-1])
+    return lines
+
+
+class MmapFileReader:
+    # FileReader alternative that finds line ends in a memory-mapped file and decodes a batch at a time,
+    # the encoding must be ASCII compatible
+
+    def __init__(cls, file_name, encoding=None):
+        import locale
+        import mmap
+        cls.file_name = file_name
+        cls.encoding = encoding or locale.getpreferredencoding(False)
+        cls.f_input = open(file_name, 'rb')
+        cls.size = os.fstat(cls.f_input.fileno()).st_size
+        cls.buffer = b""
+        if cls.size > 0:
+            cls.buffer = mmap.mmap(cls.f_input.fileno(), 0, access=mmap.ACCESS_READ)
+        cls.position = 0
+        cls.pending = []
 
-    def __init__(cls, file_name):
-        if os.path.isfile(file_name):
-            raise ErrorOutputFileAlreadyExists("Output file name already exists")
-        cls.f_output = open(file_name, 'w')
+    def __del__(cls):
+        if hasattr(cls, 'buffer') and not isinstance(cls.buffer, bytes):
+            cls.buffer.close()
+        if hasattr(cls, 'f_input'):
+            cls.f_input.close()
+
+    def read_lines(cls, count):
+        lines = cls.pending[:count]
+        del cls.pending[:count]
+        count -= len(lines)
+
+        start = cls.position
+        end = start
+        while count > 0 and end < cls.size:
+            newline = cls.buffer.find(b'\n', end)
+            end = cls.size if newline < 0 else newline + 1
+            count -= 1
+        if end > start:
+            cls.position = end
+            lines += decode_lines(cls.buffer[start:end], cls.encoding)
+        return lines
+
+    def read_line(cls):
+        lines = cls.read_lines(1)
+        if len(lines) == 0:
+            return None
+        cls.pending = lines[1:] + cls.pending
+        return lines[0]
+
+    def __iter__(cls):
+        return cls
+
+    def __next__(cls):
+        line = cls.read_line()
+        if line is None:
+            raise StopIteration
+        return line
+
+
+def sync_directory(file_name):
+    # Makes a rename into the directory durable, not every platform can open a directory
+    try:
+        directory = os.open(os.path.dirname(os.path.abspath(file_name)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(directory)
+    except OSError:
+        pass
+    finally:
+        os.close(directory)
+
+
+def publish_file(temporary_file, file_name):
+    # Syncs a completely written temporary file to disk and renames it into place
+    with open(temporary_file, 'rb') as f_temporary:
+        os.fsync(f_temporary.fileno())
+    os.replace(temporary_file, file_name)
+    sync_directory(file_name)
+
+
+class FileWriter:
+    # Writes to a file or stdout, compressed by name suffix or compression; atomic writes go to <file_name>.partial
+    # until commit() renames it, resume_offset continues a .partial file of that size
+    TEMPORARY_SUFFIX = ".partial"
+
+    def __init__(cls, file_name, buffer_size=-1, append=False, compression=None, atomic=False,
+                 resume_offset=None):
+        cls.file_name = file_name
+        cls.temporary_file = None
+        cls.appending = False
+        cls.compression = compression or compression_from_file_name(file_name)
+        if STDIO_FILE_NAME == file_name:
+            sys.stdout.flush()
+            f_binary = open(sys.stdout.fileno(), 'wb', buffering=buffer_size, closefd=False)
+        else:
+            if os.path.isfile(file_name):
+                if not append:
+                    raise ErrorOutputFileAlreadyExists("Output file name already exists")
+                cls.appending = os.path.getsize(file_name) > 0
+            path = file_name
+            mode = 'a' if append else 'w'
+            if atomic and not append:
+                path = cls.temporary_file = file_name + cls.TEMPORARY_SUFFIX
+                if None != resume_offset:
+                    os.truncate(path, resume_offset)  # Drop whatever was written after the checkpoint
+                    mode = 'a'
+                    cls.appending = resume_offset > 0
+            if None == cls.compression:
+                cls.f_output = open(path, mode, buffering=buffer_size)
+                return
+            f_binary = open(path, mode + 'b', buffering=buffer_size)
+        cls.f_binary = f_binary
+        if None == cls.compression:
+            cls.f_output = io.TextIOWrapper(f_binary)
+        else:
+            write_size = buffer_size if buffer_size > 0 else DEFAULT_BUFFER_SIZE
+            compressed = io.BufferedWriter(open_compressed(f_binary, 'wb', cls.compression), write_size)
+            cls.f_output = io.TextIOWrapper(compressed)
 
     def __del__(cls):
+        if hasattr(cls, 'f_output'):
+            cls.close()
+
+    def close(cls):
         cls.f_output.close()
+        if hasattr(cls, 'f_binary'):
+            cls.f_binary.close()
+
+    def sync(cls):
+        # Everything written so far is on disk, returns the size written
+        cls.f_output.flush()
+        f_file = getattr(cls, 'f_binary', cls.f_output)
+        f_file.flush()
+        os.fsync(f_file.fileno())
+        return f_file.tell()
+
+    def commit(cls):
+        # A writer that was never committed leaves the output file untouched
+        cls.close()
+        if None != cls.temporary_file:
+            publish_file(cls.temporary_file, cls.file_name)
+            cls.temporary_file = None
 
     def write_line(cls, line):
         cls.f_output.write(line)
 
+    def write_lines(cls, lines):
+        cls.f_output.writelines(lines)
+
+
+class FingerprintIndex:
+    # One digest per line already converted into the output file, counted so that repeated lines stay repeated
+    DIGEST_SIZE = 8
+    FILE_SUFFIX = ".idx"
+
+    def __init__(self, file_name):
+        import hashlib
+        self.blake2b = hashlib.blake2b
+        self.file_name = file_name
+        self.counts = Counter()
+        self.seen_in_run = Counter()
+        self.pending = []
+        self.rejected = Counter()  # Pending lines that were not converted after all
+        if os.path.isfile(file_name):
+            with open(file_name, 'rb') as f_index:
+                data = f_index.read()
+            size = self.DIGEST_SIZE
+            self.counts.update(data[position:position + size] for position in range(0, len(data), size))
+
+    @classmethod
+    def for_output_file(cls, output_file):
+        return cls(output_file + cls.FILE_SUFFIX)
+
+    def fingerprint(self, line):
+        # Surrounding whitespace and line endings do not make a line new
+        return self.blake2b(line.strip().encode('utf-8'), digest_size=self.DIGEST_SIZE).digest()
+
+    def is_new(self, line):
+        fingerprint = self.fingerprint(line)
+        self.seen_in_run[fingerprint] += 1
+        if self.seen_in_run[fingerprint] <= self.counts[fingerprint]:
+            return False
+        self.pending.append(fingerprint)
+        return True
+
+    def new_lines(self, lines):
+        return [line for line in lines if self.is_new(line)]
+
+    def forget(self, line):
+        # A rejected line stays out of the index, so the next run tries it again
+        self.rejected[self.fingerprint(line)] += 1
+
+    def save(self):
+        pending = self.pending
+        if len(self.rejected) > 0:
+            rejected = self.rejected
+            pending = []
+            for fingerprint in self.pending:
+                if rejected[fingerprint] > 0:
+                    rejected[fingerprint] -= 1
+                else:
+                    pending.append(fingerprint)
+        with open(self.file_name, 'ab') as f_index:
+            f_index.write(b"".join(pending))
+        self.counts.update(pending)
+        self.pending = []
+        self.rejected = Counter()
+
+    def discard(self):
+        # Forgets every converted line, the output file they were converted into is gone
+        self.counts = Counter()
+        if os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+
+
+class NewLinesReader:
+    # Only returns the lines missing from a FingerprintIndex
+
+    def __init__(cls, file_reader, fingerprint_index):
+        cls.file_reader = file_reader
+        cls.fingerprint_index = fingerprint_index
+
+    def read_lines(cls, count):
+        while True:
+            lines = cls.file_reader.read_lines(count)
+            if len(lines) == 0:
+                return lines
+            new_lines = cls.fingerprint_index.new_lines(lines)
+            if len(new_lines) > 0:
+                return new_lines
+
+    def read_line(cls):
+        lines = cls.read_lines(1)
+        if len(lines) == 0:
+            return None
+        return lines[0]
+
+    def __iter__(cls):
+        return cls
+
+    def __next__(cls):
+        line = cls.read_line()
+        if line is None:
+            raise StopIteration
+        return line
+
 
 class OutputFileName:
     ERROR_MSG_INPUT_FILE_ENDS_WITH_CSV = "Input file must not end with .csv"
+    COMPRESSION_SUFFIX = {compression: suffix for suffix, compression in COMPRESSION_SUFFIXES.items()}
 
-    def create_output_file_name(cls, input_file):
+    def create_output_file_name(cls, input_file, compression=None, suffix=".csv"):
+        if STDIO_FILE_NAME == input_file:
+            return STDIO_FILE_NAME
+
+        if None != compression_from_file_name(input_file):
+            input_file = os.path.splitext(input_file)[0]
         pcsv = re.compile(r"\.csv$")
         if pcsv.search(input_file):
             raise ErrorInputLineEndsWithCsv(cls.ERROR_MSG_INPUT_FILE_ENDS_WITH_CSV)
@@ -67,233 +417,1188 @@ class OutputFileName:
         ptxt = re.compile(r"\.txt$")
         input_file_elements = ptxt.split(input_file)
         input_file_without_postfix = input_file_elements[0]
-        output_file_name = input_file_without_postfix + ".csv"
+        output_file_name = input_file_without_postfix + suffix
+        if None != compression:
+            output_file_name += cls.COMPRESSION_SUFFIX[compression]
         return output_file_name
 
 
+class ConversionStats:
+    # Time per conversion stage and line counters, filled in when instrumentation is on
+    STAGES = ("read", "date", "payee", "amount", "write")
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.lines = 0
+        self.converted_lines = 0
+        self.skipped_lines = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return {"seconds": dict(self.seconds), "lines": self.lines, "converted_lines": self.converted_lines,
+                "skipped_lines": self.skipped_lines, "errors": self.errors}
+
+    def summary(self):
+        total = sum(self.seconds.values())
+        out_lines = ["Lines......: {} ({} converted, {} skipped, {} errors)".format(
+            self.lines, self.converted_lines, self.skipped_lines, self.errors)]
+        for stage in self.STAGES:
+            share = 100.0 * self.seconds[stage] / total if total > 0 else 0.0
+            out_lines.append("{:.<11}: {:.6f} s ({:.1f}%)".format(stage.capitalize(), self.seconds[stage], share))
+        return "\n".join(out_lines)
+
+    def write_json(self, file_name):
+        import json
+        with open(file_name, 'w') as f_output:
+            json.dump(self.as_dict(), f_output, indent=2)
+
+
+class RejectedLines:
+    # Unconvertible lines as "line_number<tab>reason<tab>line" in a sidecar file, or stderr; raises once more
+    # than max_error_rate of the lines read are rejected, counting at least MIN_CHECKED_LINES lines
+    DEFAULT_MAX_ERROR_RATE = 0.01
+    MIN_CHECKED_LINES = 1000
+    FILE_SUFFIX = ".rejected"
+
+    def __init__(self, file_name=None, max_error_rate=DEFAULT_MAX_ERROR_RATE):
+        self.file_name = file_name
+        self.max_error_rate = max_error_rate
+        self.count = 0
+        self.line_count = 0  # Input lines read, counted on by the converter
+        self.mode = 'w'
+        self.f_output = None
+        self.on_reject = None  # Called with every rejected line
+
+    @classmethod
+    def for_output_file(cls, output_file, max_error_rate=DEFAULT_MAX_ERROR_RATE):
+        if STDIO_FILE_NAME == output_file:
+            return cls(None, max_error_rate)
+        return cls(output_file + cls.FILE_SUFFIX, max_error_rate)
+
+    def reject(self, line_number, line, error):
+        if None == self.f_output:
+            self.f_output = sys.stderr if None == self.file_name else open(self.file_name, self.mode)
+        message = getattr(error, "message", None) or str(error) or type(error).__name__
+        reason = message.strip().splitlines()[0].replace('\t', ' ')
+        if not line.endswith('\n'):
+            line += '\n'
+        self.f_output.write("{}\t{}\t{}".format(line_number, reason, line))
+        self.count += 1
+        if None != self.on_reject:
+            self.on_reject(line)
+
+    def check(self, final=False):
+        if self.line_count < self.MIN_CHECKED_LINES and not final:
+            return
+        if self.count > self.max_error_rate * max(self.line_count, self.MIN_CHECKED_LINES):
+            raise ErrorTooManyRejectedLines("{} of {} lines rejected, more than {:.2%}".format(
+                self.count, self.line_count, self.max_error_rate))
+
+    def state(self):
+        # Everything rejected so far is on disk
+        offset = 0
+        if None != self.f_output:
+            self.f_output.flush()
+            if sys.stderr != self.f_output:
+                os.fsync(self.f_output.fileno())
+                offset = self.f_output.tell()
+        return {"offset": offset, "count": self.count, "line_count": self.line_count}
+
+    def can_resume(self, state):
+        if None == self.file_name or 0 == state["offset"]:
+            return True
+        return os.path.isfile(self.file_name) and os.path.getsize(self.file_name) >= state["offset"]
+
+    def resume(self, state):
+        # Drops whatever was rejected after the checkpoint, later lines are numbered on from it
+        self.count = state["count"]
+        self.line_count = state["line_count"]
+        if None == self.file_name or not os.path.isfile(self.file_name):
+            return
+        if 0 == state["offset"]:
+            os.remove(self.file_name)
+            return
+        os.truncate(self.file_name, state["offset"])
+        self.mode = 'a'
+
+    def close(self):
+        if None != self.f_output and sys.stderr != self.f_output:
+            self.f_output.close()
+
+    def remove(self):
+        # Lines rejected by an earlier run do not belong to a new conversion
+        if None != self.file_name and os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+
+
+class TransactionDeduplicator:
+    # Drops transactions (date, payee, amount) that an earlier source or the index file already holds, counted per
+    # key; 64-bit digests in a sorted array behind a Bloom filter, about 10 bytes per transaction
+    MAGIC = b"PBSDEDUP"
+    BITS_PER_TRANSACTION = 10
+    HASH_COUNT = 7
+    DEFAULT_CAPACITY = 1000000
+
+    def __init__(self, file_name=None, capacity=DEFAULT_CAPACITY):
+        import hashlib
+        from bisect import bisect_left, bisect_right
+        self.blake2b = hashlib.blake2b
+        self.bisect_left = bisect_left
+        self.bisect_right = bisect_right
+        self.file_name = file_name
+        self.known = array('Q')
+        self.added = array('Q')
+        self.duplicates = 0
+        self.bloom = bytearray()
+        if None != file_name and os.path.isfile(file_name):
+            self._load(file_name)
+        self.bloom_bits = len(self.bloom) * 8
+        capacity = max(capacity, len(self.known), 1)
+        if self.capacity() < capacity:
+            self._resize_bloom(capacity)
+        self.start_source()
+
+    def _load(self, file_name):
+        with open(file_name, 'rb') as f_index:
+            if f_index.read(len(self.MAGIC)) != self.MAGIC:
+                raise Exception("Not a deduplication index: " + file_name)
+            bloom_size = int.from_bytes(f_index.read(8), 'little')
+            self.bloom = bytearray(f_index.read(bloom_size))
+            self.known.frombytes(f_index.read())
+
+    def save(self, file_name=None):
+        file_name = file_name or self.file_name
+        self.end_source()
+        if len(self.known) > self.capacity():
+            self._resize_bloom(2 * len(self.known))  # Doubling keeps the number of rebuilds low
+        with open(file_name, 'wb') as f_index:
+            f_index.write(self.MAGIC)
+            f_index.write(len(self.bloom).to_bytes(8, 'little'))
+            f_index.write(self.bloom)
+            self.known.tofile(f_index)
+
+    def capacity(self):
+        return self.bloom_bits // self.BITS_PER_TRANSACTION
+
+    def _resize_bloom(self, capacity):
+        # A Bloom filter cannot grow in place, every known digest is added to a new one
+        self.bloom = bytearray((capacity * self.BITS_PER_TRANSACTION + 7) // 8)
+        self.bloom_bits = len(self.bloom) * 8
+        bloom = self.bloom
+        for digests in (self.known, self.added):
+            for digest in digests:
+                for position in self._bloom_positions(digest):
+                    bloom[position >> 3] |= 1 << (position & 7)
+
+    def start_source(self):
+        # Occurrences of a source that was not ended are forgotten
+        self.added = array('Q')
+        self.consumed = bytearray((len(self.known) + 7) // 8)  # Known occurrences matched in this source
+
+    def end_source(self):
+        # Later sources count the occurrences of this one as known
+        if len(self.known) == 0:
+            self.known = array('Q', sorted(self.added))
+        elif len(self.added) > 0:
+            known = self.known
+            merged = array('Q')
+            start = 0
+            for digest in sorted(self.added):
+                end = self.bisect_right(known, digest, start)
+                merged.extend(known[start:end])
+                merged.append(digest)
+                start = end
+            merged.extend(known[start:])
+            self.known = merged
+        self.start_source()
+
+    def digest(self, converted_line):
+        # Date,Payee,Category,Memo,Outflow,Inflow - payee never contains ',' after conversion
+        items = converted_line.rstrip('\n').split(',')
+        key = "\t".join((items[0], items[1], items[4], items[5])).encode('utf-8')
+        return int.from_bytes(self.blake2b(key, digest_size=8).digest(), 'little')
+
+    def _bloom_positions(self, digest):
+        first, second = digest & 0xffffffff, (digest >> 32) | 1
+        return [(first + index * second) % self.bloom_bits for index in range(self.HASH_COUNT)]
+
+    def _consume_known(self, digest):
+        # Marks one not yet matched known occurrence of digest, False when there is none left
+        known = self.known
+        consumed = self.consumed
+        for index in range(self.bisect_left(known, digest), len(known)):
+            if known[index] != digest:
+                break
+            if not consumed[index >> 3] & (1 << (index & 7)):
+                consumed[index >> 3] |= 1 << (index & 7)
+                return True
+        return False
+
+    def is_duplicate(self, converted_line):
+        digest = self.digest(converted_line)
+        positions = self._bloom_positions(digest)
+        bloom = self.bloom
+        if all(bloom[position >> 3] & (1 << (position & 7)) for position in positions):
+            if self._consume_known(digest):
+                self.duplicates += 1
+                return True
+        else:
+            for position in positions:
+                bloom[position >> 3] |= 1 << (position & 7)
+        self.added.append(digest)
+        return False
+
+
+class DeduplicatingWriter:
+    # Drops converted lines a TransactionDeduplicator has already seen
+
+    def __init__(cls, file_writer, deduplicator):
+        cls.file_writer = file_writer
+        cls.deduplicator = deduplicator
+
+    def write_line(cls, line):
+        # The parallel path writes whole chunks of converted lines at once
+        cls.write_lines(line.splitlines(True))
+
+    def write_lines(cls, lines):
+        is_duplicate = cls.deduplicator.is_duplicate
+        cls.file_writer.write_lines([line for line in lines if not is_duplicate(line)])
+
+
+class ConversionCheckpoint:
+    # Input and output offsets saved as json next to the output file, ignored for another bank or changed input
+    FILE_SUFFIX = ".checkpoint"
+    DEFAULT_INTERVAL = 10.0
+
+    def __init__(self, file_name, input_file, bank, interval=DEFAULT_INTERVAL):
+        self.file_name = file_name
+        self.input_file = input_file
+        self.bank = bank
+        self.interval = interval
+        input_stat = os.stat(input_file)
+        self.input_signature = [input_stat.st_size, input_stat.st_mtime_ns]
+        self.input_offset = 0
+        self.output_offset = None
+        self.rejected = None
+        if os.path.isfile(file_name):
+            self.load()
+
+    @classmethod
+    def for_output_file(cls, output_file, input_file, bank, interval=DEFAULT_INTERVAL):
+        return cls(output_file + cls.FILE_SUFFIX, input_file, bank, interval)
+
+    def load(self):
+        import json
+        try:
+            with open(self.file_name, 'r') as f_checkpoint:
+                state = json.load(f_checkpoint)
+        except ValueError:
+            return  # Cut off while written, start over
+        if state.get("bank") != self.bank or state.get("input_signature") != self.input_signature:
+            return
+        self.input_offset = state["input_offset"]
+        self.output_offset = state["output_offset"]
+        self.rejected = state.get("rejected")
+
+    def resume_offset(self, partial_file, rejected_lines=None):
+        # The output offset to continue from, or None when there is nothing to resume
+        if None == self.output_offset or not os.path.isfile(partial_file):
+            return None
+        if os.path.getsize(partial_file) < self.output_offset:
+            return None
+        if None != rejected_lines and not rejected_lines.can_resume(self.rejected_lines_state()):
+            return None
+        return self.output_offset
+
+    def rejected_lines_state(self):
+        if None != self.rejected:
+            return self.rejected
+        # Saved by a run that did not reject lines, which stopped at the first bad one
+        return {"offset": 0, "count": 0, "line_count": count_lines(self.input_file, self.input_offset)}
+
+    def save(self, input_offset, output_offset, rejected=None):
+        import json
+        state = {"bank": self.bank, "input_signature": self.input_signature,
+                 "input_offset": input_offset, "output_offset": output_offset, "rejected": rejected}
+        temporary_file = self.file_name + ".tmp"
+        with open(temporary_file, 'w') as f_checkpoint:
+            json.dump(state, f_checkpoint)
+            f_checkpoint.flush()
+            os.fsync(f_checkpoint.fileno())
+        os.replace(temporary_file, self.file_name)
+        self.input_offset = input_offset
+        self.output_offset = output_offset
+        self.rejected = rejected
+
+    def remove(self):
+        if os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+
+
+class CheckpointingWriter:
+    # Saves a ConversionCheckpoint right after a write, at most every checkpoint.interval seconds
+
+    def __init__(cls, file_writer, file_reader, checkpoint, rejected_lines=None):
+        cls.file_writer = file_writer
+        cls.file_reader = file_reader
+        cls.checkpoint = checkpoint
+        cls.rejected_lines = rejected_lines
+        cls.appending = file_writer.appending
+        cls.last_checkpoint = time.monotonic()
+
+    def write_line(cls, line):
+        cls.file_writer.write_line(line)
+        cls._checkpoint_if_due()
+
+    def write_lines(cls, lines):
+        cls.file_writer.write_lines(lines)
+        cls._checkpoint_if_due()
+
+    def _checkpoint_if_due(cls):
+        now = time.monotonic()
+        if now - cls.last_checkpoint < cls.checkpoint.interval:
+            return
+        output_offset = cls.file_writer.sync()
+        rejected = None if None == cls.rejected_lines else cls.rejected_lines.state()
+        cls.checkpoint.save(cls.file_reader.tell(), output_offset, rejected)
+        cls.last_checkpoint = now
+
+
+def split_file_into_chunks(file_name, chunk_count, min_chunk_size=0):
+    # Byte ranges (start, end) that always begin and end on a line boundary
+    file_size = os.path.getsize(file_name)
+    chunk_size = max(file_size // max(chunk_count, 1), min_chunk_size, 1)
+    chunks = []
+    with open(file_name, 'rb') as f_input:
+        start = 0
+        while start < file_size:
+            f_input.seek(min(start + chunk_size, file_size))
+            f_input.readline()
+            end = min(f_input.tell(), file_size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def count_lines(file_name, end):
+    # Lines before offset end of FileReader.tell(), which counts decompressed bytes of a compressed file
+    file_reader = FileReader(file_name)
+    f_input = file_reader.f_input.buffer
+    line_count = 0
+    while end > 0:
+        block = f_input.read(min(end, DEFAULT_BUFFER_SIZE))
+        if len(block) == 0:
+            break
+        line_count += block.count(b'\n')
+        end -= len(block)
+    return line_count
+
+
+def _convert_chunk(chunk_job):
+    line_converter_class, bank, file_name, encoding, start, end = chunk_job
+    statement_line_converter = line_converter_class(bank)
+    with open(file_name, 'rb') as f_input:
+        f_input.seek(start)
+        data = f_input.read(end - start)
+    # Decode like FileReader does, including universal newline translation
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding=encoding)
+    return "".join(map(statement_line_converter.convert_line, lines))
+
+
 class StatementConverter:
+    DEFAULT_BATCH_SIZE = 4096
+    MIN_CHUNK_SIZE = 1024 * 1024
+    CHUNKS_PER_WORKER = 4
 
-    def __init__(cls, statement_line_converter, file_reader, file_writer):
+    def __init__(cls, statement_line_converter, file_reader, file_writer, batch_size=None, workers=None,
+                 stats=None, deduplicator=None, rejected_lines=None):
 
         cls.statement_line_converter = statement_line_converter
         cls.file_reader = file_reader
         cls.file_writer = file_writer
+        cls.batch_size = batch_size
+        cls.workers = workers
+        cls.stats = stats
+        cls.deduplicator = deduplicator
+        cls.rejected_lines = rejected_lines
 
     def add_csv_header(cls, file_writer):
+        if getattr(file_writer, "appending", False):
+            return  # Appending to an earlier conversion that already has the header
         out_line = "Date,Payee,Category,Memo,Outflow,Inflow\n"
         file_writer.write_line(out_line)
 
     def convert(cls):
 
+        if hasattr(cls.file_writer, "write_records"):
+            cls._convert_records()  # Record writers have their own layout, no csv header
+            return
+
         cls.add_csv_header(cls.file_writer)
 
+        file_writer = cls.file_writer
+        if cls.deduplicator is not None:
+            cls.deduplicator.start_source()
+            cls.file_writer = DeduplicatingWriter(file_writer, cls.deduplicator)
+        try:
+            cls._convert_lines()
+        finally:
+            cls.file_writer = file_writer
+        if cls.deduplicator is not None:
+            cls.deduplicator.end_source()
+
+    def _convert_lines(cls):
+        if cls.stats is not None:
+            if cls.workers and cls.workers > 1:
+                # Chunks are converted in other processes, the statistics would describe another path
+                raise Exception("Statistics cannot be collected for a conversion in several worker processes")
+            # Separate loop so that the uninstrumented paths carry no timing overhead
+            cls._convert_instrumented()
+            return
+
+        if cls.rejected_lines is not None:
+            cls._convert_tolerant()
+            return
+
+        if cls.workers and cls.workers > 1:
+            cls._convert_chunks_in_parallel()
+            return
+
+        if cls.batch_size:
+            cls._convert_batches()
+            return
+
         for line in cls.file_reader:
             converted_line = cls.statement_line_converter.convert_line(line)
             if len(converted_line) > 0:
                 cls.file_writer.write_line(converted_line)
 
+    def _batch_converter(cls):
+        convert_line = cls.statement_line_converter.convert_line
+        return lambda lines: [converted for converted in map(convert_line, lines) if len(converted) > 0]
+
+    def _convert_batches(cls):
+        # Only one batch of lines is held in memory, whatever the input size
+        convert_lines = cls._batch_converter()
+        while True:
+            lines = cls.file_reader.read_lines(cls.batch_size)
+            if len(lines) == 0:
+                break
+            cls.file_writer.write_lines(convert_lines(lines))
+
+    def _convert_records(cls):
+        # Transaction records straight to the writer, no csv lines are formatted
+        line_converter = cls.statement_line_converter
+        if cls.rejected_lines is not None:
+            cls._convert_tolerant(line_converter.convert_records, line_converter.convert_record,
+                                  cls.file_writer.write_records)
+            return
+        batch_size = cls.batch_size or cls.DEFAULT_BATCH_SIZE
+        while True:
+            lines = cls.file_reader.read_lines(batch_size)
+            if len(lines) == 0:
+                break
+            cls.file_writer.write_records(line_converter.convert_records(lines))
+
+    def _convert_tolerant(cls, convert_lines=None, convert_line=None, write_lines=None):
+        # Batches convert as fast as usual, only a batch that fails is converted again line by line
+        convert_lines = convert_lines or cls._batch_converter()
+        convert_line = convert_line or cls.statement_line_converter.convert_line
+        write_lines = write_lines or cls.file_writer.write_lines
+        rejected_lines = cls.rejected_lines
+        batch_size = cls.batch_size or 1
+
+        while True:
+            lines = cls.file_reader.read_lines(batch_size)
+            if len(lines) == 0:
+                break
+            try:
+                converted_lines = convert_lines(lines)
+            except Exception:
+                converted_lines = []
+                for line_number, line in enumerate(lines, rejected_lines.line_count + 1):
+                    try:
+                        converted_line = convert_line(line)
+                    except Exception as error:
+                        rejected_lines.reject(line_number, line, error)
+                        continue
+                    if converted_line:  # Not an ignored line
+                        converted_lines.append(converted_line)
+            rejected_lines.line_count += len(lines)  # Before writing, a checkpoint may be taken then
+            write_lines(converted_lines)
+            rejected_lines.check()
+        rejected_lines.check(final=True)
+
+    def _convert_instrumented(cls):
+        stats = cls.stats
+        line_converter = cls.statement_line_converter
+        convert_line = getattr(line_converter, "convert_line_instrumented", None)
+        if None == convert_line:
+            convert_line = lambda line, stats: line_converter.convert_line(line)
+        batch_size = cls.batch_size or 1
+        perf_counter = time.perf_counter
+
+        while True:
+            start = perf_counter()
+            lines = cls.file_reader.read_lines(batch_size)
+            stats.seconds["read"] += perf_counter() - start
+            if len(lines) == 0:
+                break
+
+            converted_lines = []
+            for line_number, line in enumerate(lines, 1):
+                stats.lines += 1
+                try:
+                    converted_line = convert_line(line, stats)
+                except Exception as error:
+                    stats.errors += 1
+                    if cls.rejected_lines is None:
+                        raise
+                    cls.rejected_lines.reject(cls.rejected_lines.line_count + line_number, line, error)
+                    continue
+                if len(converted_line) > 0:
+                    converted_lines.append(converted_line)
+                else:
+                    stats.skipped_lines += 1
+            stats.converted_lines += len(converted_lines)
+            if cls.rejected_lines is not None:
+                cls.rejected_lines.line_count += len(lines)
+
+            start = perf_counter()
+            cls.file_writer.write_lines(converted_lines)
+            stats.seconds["write"] += perf_counter() - start
+            if cls.rejected_lines is not None:
+                cls.rejected_lines.check()
+        if cls.rejected_lines is not None:
+            cls.rejected_lines.check(final=True)
+
+    def _convert_chunks_in_parallel(cls):
+        file_name = cls.file_reader.file_name
+        chunks = split_file_into_chunks(file_name, cls.workers * cls.CHUNKS_PER_WORKER, cls.MIN_CHUNK_SIZE)
+        line_converter = cls.statement_line_converter
+        chunk_jobs = [(type(line_converter), line_converter.bank, file_name, cls.file_reader.encoding,
+                       start, end) for start, end in chunks]
+        from concurrent.futures import ProcessPoolExecutor
+        # Every worker builds its own line converter, results come back in input order
+        with ProcessPoolExecutor(max_workers=cls.workers) as executor:
+            for converted_chunk in executor.map(_convert_chunk, chunk_jobs):
+                cls.file_writer.write_line(converted_chunk)
+
+
+def amount_to_ore(amount):
+    # Cleaned amount such as "-3412.58", "+37299.00" or "99" to signed integer öre, no float or Decimal
+    negative = amount.startswith('-')
+    digits = amount[1:] if negative or amount.startswith('+') else amount
+    kronor, separator, ore = digits.partition('.')
+    if len(ore) > 2 or not (kronor + ore).isdecimal():
+        raise Exception("Invalid amount: " + amount)
+    value = int(kronor or '0') * 100 + int(ore.ljust(2, '0'))
+    return -value if negative else value
+
+
+def ore_to_amount(ore):
+    sign = "-" if ore < 0 else ""
+    kronor, ore = divmod(abs(ore), 100)
+    return "{}{}.{:02d}".format(sign, kronor, ore)
+
+
+class Transaction:
+    # One converted line, outflow and inflow as in the csv file and amount as signed integer öre
+    __slots__ = ("date", "payee", "outflow", "inflow", "amount")
+
+    def __init__(self, date, payee, outflow, inflow, amount):
+        self.date = date
+        self.payee = payee
+        self.outflow = outflow
+        self.inflow = inflow
+        self.amount = amount
+
+    def __eq__(self, other):
+        if not isinstance(other, Transaction):
+            return NotImplemented
+        return (self.date, self.payee, self.outflow, self.inflow, self.amount) == \
+            (other.date, other.payee, other.outflow, other.inflow, other.amount)
+
+    def __repr__(self):
+        return "Transaction({!r}, {!r}, {!r}, {!r}, {!r})".format(self.date, self.payee, self.outflow,
+                                                                  self.inflow, self.amount)
+
+
+def transactions_to_csv(transactions):
+    # Date,Payee,Category,Memo,Outflow,Inflow
+    return "".join(["{},{},,,{},{}\n".format(transaction.date, transaction.payee, transaction.outflow,
+                                              transaction.inflow) for transaction in transactions])
+
+
+def iso_date(date):
+    # "dd/mm/yyyy" as in the csv file to "yyyy-mm-dd"
+    return date[6:10] + "-" + date[3:5] + "-" + date[0:2]
+
+
+def check_record_output_file(file_name, compression, output_format):
+    if STDIO_FILE_NAME == file_name:
+        raise Exception("{} output needs an output file, not stdout".format(output_format))
+    if None != compression:
+        raise Exception("{} output cannot be compressed".format(output_format))
+    if os.path.isfile(file_name):
+        raise ErrorOutputFileAlreadyExists("Output file name already exists")
+
+
+class JsonLinesWriter:
+    # One json object per transaction, amount in öre, written through a FileWriter
+
+    def __init__(cls, file_name, buffer_size=-1, compression=None):
+        import json
+        cls.dumps = json.dumps
+        cls.file_writer = FileWriter(file_name, buffer_size, compression=compression, atomic=True)
+
+    def write_records(cls, transactions):
+        dumps = cls.dumps
+        cls.file_writer.write_lines(['{{"date": "{}", "payee": {}, "amount": {}}}\n'.format(
+            iso_date(transaction.date), dumps(transaction.payee, ensure_ascii=False), transaction.amount)
+            for transaction in transactions])
+
+    def commit(cls):
+        cls.file_writer.commit()
+
+    def close(cls):
+        cls.file_writer.close()
+
+
+class SqliteWriter:
+    # Bulk inserts into a temporary SQLite file without journal or syncing, renamed into place by commit()
+    TABLE = "transactions"
+
+    def __init__(cls, file_name, buffer_size=-1, compression=None):
+        import sqlite3
+        check_record_output_file(file_name, compression, "SQLite")
+        cls.file_name = file_name
+        cls.temporary_file = file_name + FileWriter.TEMPORARY_SUFFIX
+        if os.path.isfile(cls.temporary_file):
+            os.remove(cls.temporary_file)  # Left behind by an interrupted run
+        cls.connection = sqlite3.connect(cls.temporary_file, isolation_level=None)
+        cls.connection.execute("PRAGMA journal_mode = OFF")
+        cls.connection.execute("PRAGMA synchronous = OFF")
+        cls.connection.execute("CREATE TABLE {} (date TEXT NOT NULL, payee TEXT NOT NULL, amount INTEGER NOT NULL)"
+                               .format(cls.TABLE))
+        cls.connection.execute("BEGIN")
+
+    def __del__(cls):
+        if hasattr(cls, 'connection'):
+            cls.connection.close()
+
+    def write_records(cls, transactions):
+        cls.connection.executemany("INSERT INTO {} VALUES (?, ?, ?)".format(cls.TABLE),
+                                   [(iso_date(transaction.date), transaction.payee, transaction.amount)
+                                    for transaction in transactions])
+
+    def commit(cls):
+        cls.connection.execute("COMMIT")
+        cls.connection.close()
+        publish_file(cls.temporary_file, cls.file_name)
+
+    def close(cls):
+        cls.connection.close()
+
+
+def load_pyarrow():
+    # Optional, only needed for Arrow and Parquet output
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow
+        except ImportError:
+            return None
+    return pyarrow
+
+
+class ArrowWriter:
+    # Arrow IPC file with date32, string and int64 öre columns, one record batch per batch of lines
+    FORMAT = "Arrow"
+
+    def __init__(cls, file_name, buffer_size=-1, compression=None):
+        if load_pyarrow() is None:
+            raise ImportError("pyarrow is required for {} output".format(cls.FORMAT))
+        import datetime
+        check_record_output_file(file_name, compression, cls.FORMAT)
+        cls.pyarrow = pyarrow
+        cls.date = datetime.date
+        cls.schema = pyarrow.schema([("date", pyarrow.date32()), ("payee", pyarrow.string()),
+                                     ("amount", pyarrow.int64())])
+        cls.file_name = file_name
+        cls.temporary_file = file_name + FileWriter.TEMPORARY_SUFFIX
+        cls.writer = cls.open_writer(cls.temporary_file)
+
+    def open_writer(cls, file_name):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(file_name, cls.schema)
+
+    def write_records(cls, transactions):
+        if len(transactions) == 0:
+            return
+        pyarrow = cls.pyarrow
+        date = cls.date
+        dates = [date(int(t.date[6:10]), int(t.date[3:5]), int(t.date[0:2])) for t in transactions]
+        table = pyarrow.Table.from_arrays([pyarrow.array(dates, pyarrow.date32()),
+                                          pyarrow.array([t.payee for t in transactions], pyarrow.string()),
+                                          pyarrow.array([t.amount for t in transactions], pyarrow.int64())],
+                                         schema=cls.schema)
+        cls.writer.write_table(table)
+
+    def commit(cls):
+        cls.writer.close()
+        publish_file(cls.temporary_file, cls.file_name)
+
+    def close(cls):
+        cls.writer.close()
+
+
+class ParquetWriter(ArrowWriter):
+    # Parquet file with the ArrowWriter columns, one row group per batch
+    FORMAT = "Parquet"
+
+    def open_writer(cls, file_name):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(file_name, cls.schema)
+
+
+OutputFormat = namedtuple("OutputFormat", ["suffix", "writer_class"])
+
+# FileWriter takes csv lines, the other writers take Transaction records
+OUTPUT_FORMATS = {
+    "csv": OutputFormat(".csv", FileWriter),
+    "jsonl": OutputFormat(".jsonl", JsonLinesWriter),
+    "sqlite": OutputFormat(".sqlite", SqliteWriter),
+    "arrow": OutputFormat(".arrow", ArrowWriter),
+    "parquet": OutputFormat(".parquet", ParquetWriter),
+}
+
+
+def register_output_format(name, output_format):
+    OUTPUT_FORMATS[name] = output_format
+
+
+class Ledger:
+    # SQLite database in WAL mode with the transactions of many statements and a monthly sums table,
+    # payees are matched on a casefolded copy since SQLite only folds ASCII
+    CACHE_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, file_name):
+        import sqlite3
+        self.file_name = file_name
+        self.connection = sqlite3.connect(file_name, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")  # Durable at every checkpoint in WAL mode
+        # Keeps the index pages that bulk inserts touch in memory, negative sizes are in KiB
+        self.connection.execute("PRAGMA cache_size = -{}".format(self.CACHE_SIZE // 1024))
+        self.connection.execute("PRAGMA case_sensitive_like = ON")  # LIKE on payee_key can use its index
+        self.connection.execute("CREATE TABLE IF NOT EXISTS transactions (date TEXT NOT NULL, payee TEXT NOT NULL, "
+                                "payee_key TEXT NOT NULL, amount INTEGER NOT NULL, bank TEXT NOT NULL, "
+                                "source TEXT NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS monthly (month TEXT NOT NULL, bank TEXT NOT NULL, "
+                                "payee_key TEXT NOT NULL, count INTEGER NOT NULL, amount INTEGER NOT NULL, "
+                                "PRIMARY KEY (month, bank, payee_key))")
+
+    def __del__(self):
+        if hasattr(self, 'connection'):
+            self.connection.close()
+
+    def close(self):
+        self.connection.close()
+
+    def create_indexes(self):
+        # Created after the first load, so the first bulk insert does not maintain them row by row
+        for name, columns in [("date", "date"), ("payee", "payee_key, date"), ("bank", "bank, date"), ("source", "source")]:
+            self.connection.execute("CREATE INDEX IF NOT EXISTS transactions_{} ON transactions ({})".format(
+                name, columns))
+
+    def writer(self, bank, source):
+        return LedgerWriter(self, bank, source)
+
+    def refresh_monthly(self, first_date, last_date):
+        first_month = first_date[:7]
+        last_month = last_date[:7]
+        self.connection.execute("DELETE FROM monthly WHERE month BETWEEN ? AND ?", (first_month, last_month))
+        self.connection.execute("INSERT INTO monthly SELECT substr(date, 1, 7), bank, payee_key, count(*), "
+                                "sum(amount) FROM transactions WHERE date BETWEEN ? AND ? GROUP BY 1, 2, 3",
+                                (first_month + "-01", last_month + "-31"))
+
+    def transactions(self, date_from=None, date_to=None, payee=None, bank=None, limit=None):
+        # Rows of (date, payee, amount in öre, bank), payee is a LIKE pattern such as "ica%"
+        where, parameters = self._where("date", date_from, date_to, payee, bank)
+        sql = "SELECT date, payee, amount, bank FROM transactions" + where + " ORDER BY date"
+        if None != limit:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def monthly_sums(self, date_from=None, date_to=None, payee=None, bank=None):
+        # Rows of (month, count, amount in öre), always over whole months
+        where, parameters = self._where("month", date_from and date_from[:7], date_to and date_to[:7], payee, bank)
+        sql = "SELECT month, sum(count), sum(amount) FROM monthly" + where + " GROUP BY month ORDER BY month"
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def _where(self, date_column, date_from, date_to, payee, bank):
+        conditions = []
+        parameters = []
+        if None != date_from:
+            conditions.append(date_column + " >= ?")
+            parameters.append(date_from)
+        if None != date_to:
+            conditions.append(date_column + " <= ?")
+            parameters.append(date_to)
+        if None != payee:
+            # An exact payee can use the date part of the payee index as well
+            exact = '%' not in payee and '_' not in payee
+            conditions.append("payee_key = ?" if exact else "payee_key LIKE ?")
+            parameters.append(payee.casefold())
+        if None != bank:
+            conditions.append("bank = ?")
+            parameters.append(bank)
+        if len(conditions) == 0:
+            return "", parameters
+        return " WHERE " + " AND ".join(conditions), parameters
+
+
+class LedgerWriter:
+    # Loads one statement in a single transaction, replacing the rows of an earlier load of it
+
+    def __init__(cls, ledger, bank, source):
+        cls.ledger = ledger
+        cls.connection = ledger.connection
+        cls.bank = bank
+        cls.source = source
+        cls.count = 0
+        cls.connection.execute("BEGIN IMMEDIATE")
+        cls.first_date, cls.last_date = cls.connection.execute(
+            "SELECT min(date), max(date) FROM transactions WHERE source = ?", (source,)).fetchone()
+        cls.connection.execute("DELETE FROM transactions WHERE source = ?", (source,))
+
+    def write_records(cls, transactions):
+        if len(transactions) == 0:
+            return
+        bank = cls.bank
+        source = cls.source
+        rows = [(iso_date(transaction.date), transaction.payee, transaction.payee.casefold(), transaction.amount, bank,
+                 source) for transaction in transactions]
+        cls.connection.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?)", rows)
+        cls.count += len(rows)
+        first_date = min(row[0] for row in rows)
+        last_date = max(row[0] for row in rows)
+        if None == cls.first_date or first_date < cls.first_date:
+            cls.first_date = first_date
+        if None == cls.last_date or last_date > cls.last_date:
+            cls.last_date = last_date
+
+    def commit(cls):
+        if None != cls.first_date:
+            cls.ledger.refresh_monthly(cls.first_date, cls.last_date)
+        cls.ledger.create_indexes()
+        cls.connection.execute("COMMIT")
+
+    def close(cls):
+        if cls.connection.in_transaction:
+            cls.connection.execute("ROLLBACK")
+
+
+def load_into_ledger(ledger, bank, input_file, batch_size=StatementConverter.DEFAULT_BATCH_SIZE,
+                     buffer_size=DEFAULT_BUFFER_SIZE, rejected_lines=None, source=None):
+    # source names the statement, loading the same source again replaces it (default: the input file path)
+    if STDIO_FILE_NAME == input_file and None == source:
+        raise Exception("Loading stdin needs a source name, every stdin load would replace the previous one")
+    if AUTO_BANK == bank:
+        bank = sniff_bank(input_file)
+    source = source or os.path.abspath(input_file)
+    if None != rejected_lines:
+        rejected_lines.remove()
+    ledger_writer = ledger.writer(bank, source)
+    try:
+        statement_converter = StatementConverter(GeneralLineConverter(bank), FileReader(input_file, buffer_size),
+                                                 ledger_writer, batch_size, rejected_lines=rejected_lines)
+        statement_converter.convert()
+        ledger_writer.commit()
+    finally:
+        ledger_writer.close()
+    return ledger_writer.count
+
+
+class DateCache:
+    # Bounded LRU cache of converted dates keyed by raw date string and date format
+    DEFAULT_MAX_SIZE = 4096
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, date_string, format_date):
+        key = (date_string, format_date)
+        converted = self.entries.get(key)
+        if converted is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return converted
+
+    def put(self, date_string, format_date, converted):
+        self.entries[(date_string, format_date)] = converted
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "max_size": self.max_size}
+
+
+# Shared by every line converter; a statement only covers a few hundred distinct dates
+DATE_CACHE = DateCache()
+
+
+class LineFields:
+    # Fields of one statement line, split once and reused by every parse step
+    __slots__ = ("line", "items")
+
+    def __init__(self):
+        self.line = ""
+        self.items = []
+
+    def load(self, line, delimiter):
+        self.line = line
+        self.items = line.split(delimiter)
+        return self
+
+
+REGEXP_YEAR_MONTH_DAY = r"\d\d\d\d-\d\d-\d\d"
+REGEXP_DAY_MONTHSTRING_YEAR = r"\d\d [A-Za-ö]{3,3} \d\d\d\d"
+FORMAT_YEAR_MONTH_DAY = "%Y-%m-%d"
+FORMAT_DAY_MONTH_YEAR_SPACES = "%d %m %Y"
+
+BankProfile = namedtuple("BankProfile", ["delimiter", "transaction_position", "payee_position",
+                                         "transaction_includes_currency", "use_second_data", "regexp_date",
+                                         "format_date", "convert_date_with_month_string", "ignore_line"])
+
+
+def bank_profile(transaction_position, payee_position, transaction_includes_currency='kr', delimiter='\t',
+                 use_second_data=False, regexp_date=REGEXP_YEAR_MONTH_DAY, format_date=FORMAT_YEAR_MONTH_DAY,
+                 convert_date_with_month_string=False, ignore_line=""):
+    return BankProfile(delimiter, transaction_position, payee_position, transaction_includes_currency,
+                       use_second_data, regexp_date, format_date, convert_date_with_month_string, ignore_line)
+
+
+BANK_PROFILES = {
+    "santander": bank_profile(transaction_position=4, payee_position=2,
+                              ignore_line="Transaktioner ovan har du ännu inte fått på ditt kontoutdrag."),
+    "skandia": bank_profile(transaction_position=2, payee_position=1, transaction_includes_currency='',
+                            use_second_data=True),
+    "ica": bank_profile(transaction_position=4, payee_position=1),
+    "ica2": bank_profile(transaction_position=4, payee_position=1, regexp_date=REGEXP_DAY_MONTHSTRING_YEAR,
+                         format_date=FORMAT_DAY_MONTH_YEAR_SPACES, convert_date_with_month_string=True),
+    # ica2 exports saved as ';' separated files with ISO dates
+    "ica2_semicolon": bank_profile(transaction_position=4, payee_position=1, delimiter=';'),
+}
+
+
+def register_bank_profile(bank, profile):
+    BANK_PROFILES[bank] = profile
+
+
+_compiled_regexps = {}
+
+
+def compile_regexp(regexp):
+    # Every profile regexp is compiled once per process, whatever the number of converters
+    compiled = _compiled_regexps.get(regexp)
+    if compiled is None:
+        compiled = re.compile(regexp)
+        _compiled_regexps[regexp] = compiled
+    return compiled
+
+
+AUTO_BANK = "auto"
+SNIFF_SIZE = 4096
+SNIFF_LINES = 20
+REGEXP_CLEANED_AMOUNT = r"-?\d+(\.\d*)?"
+
+
+def profile_accepts_line(profile, fields, compiled_date):
+    # Cheap structural checks on one line split by the profile delimiter, no date or payee conversion
+    if len(fields) <= max(profile.transaction_position, profile.payee_position):
+        return False
+    transaction = fields[profile.transaction_position]
+    if (len(profile.transaction_includes_currency) > 0) != ("kr" in transaction):
+        return False
+    amount = transaction.replace(',', '.').replace(' ', '').replace(profile.transaction_includes_currency, '')
+    if compile_regexp(REGEXP_CLEANED_AMOUNT).fullmatch(amount.strip()) is None:
+        return False
+    # Every column before the payee is a date, and the payee is not
+    for field in fields[:profile.payee_position]:
+        if compiled_date.fullmatch(field.strip()) is None:
+            return False
+    if compiled_date.fullmatch(fields[profile.payee_position].strip()) is not None:
+        return False
+    return len(compiled_date.findall(profile.delimiter.join(fields))) <= 2
+
+
+def detect_bank(lines, profiles=BANK_PROFILES):
+    # Bank whose profile fits the most sample lines, lines no profile fits are not counted
+    scores = dict.fromkeys(profiles, 0)
+    compiled_dates = {bank: compile_regexp(profile.regexp_date) for bank, profile in profiles.items()}
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if len(line.strip()) == 0:
+            continue
+        fields_by_delimiter = {}
+        for bank, profile in profiles.items():
+            if len(profile.ignore_line) > 0 and profile.ignore_line in line:
+                continue
+            fields = fields_by_delimiter.get(profile.delimiter)
+            if fields is None:
+                fields = fields_by_delimiter[profile.delimiter] = line.split(profile.delimiter)
+            if profile_accepts_line(profile, fields, compiled_dates[bank]):
+                scores[bank] += 1
+    ranking = sorted(scores.items(), key=lambda score: score[1], reverse=True)
+    if 0 == len(ranking) or 0 == ranking[0][1]:
+        raise Exception("Cannot detect bank, no known format matches the input")
+    if len(ranking) > 1 and ranking[0][1] == ranking[1][1]:
+        raise Exception("Cannot detect bank, input matches both {} and {}".format(ranking[0][0], ranking[1][0]))
+    return ranking[0][0]
+
+
+def sniff_bank(file_name, profiles=BANK_PROFILES):
+    # Only the first SNIFF_SIZE characters are read, a cut off last line is left out
+    if STDIO_FILE_NAME == file_name:
+        raise Exception("Cannot detect bank of stdin, give the bank")
+    file_reader = FileReader(file_name)
+    sample = file_reader.f_input.read(SNIFF_SIZE)
+    lines = sample.splitlines()
+    if len(sample) == SNIFF_SIZE and len(lines) > 1:
+        lines.pop()
+    return detect_bank(lines[:SNIFF_LINES], profiles)
+
 
 class GeneralLineConverter:
-    REGEXP_YEAR_MONTH_DAY = r"\d\d\d\d-\d\d-\d\d"
-    REGEXP_DAY_MONTHSTRING_YEAR = r"\d\d [a-ö]{3,3} \d\d\d\d"
-    FORMAT_YEAR_MONTH_DAY = "%Y-%m-%d"
+    REGEXP_YEAR_MONTH_DAY = REGEXP_YEAR_MONTH_DAY
+    REGEXP_DAY_MONTHSTRING_YEAR = REGEXP_DAY_MONTHSTRING_YEAR
+    FORMAT_YEAR_MONTH_DAY = FORMAT_YEAR_MONTH_DAY
     FORMAT_DAY_MONTH_YEAR = "%d/%m/%Y"
-    FORMAT_DAY_MONTH_YEAR_SPACES = "%d %m %Y"
+    FORMAT_DAY_MONTH_YEAR_SPACES = FORMAT_DAY_MONTH_YEAR_SPACES
     YEAR_MONTH_DAY_LENGTH = 11
+    # Swedish and English month abbreviations, matched case-insensitively
+    MONTH_NUMBERS = {
+        "jan": "01", "feb": "02", "mar": "03", "apr": "04",
+        "maj": "05", "may": "05", "jun": "06", "jul": "07",
+        "aug": "08", "sep": "09", "okt": "10", "oct": "10",
+        "nov": "11", "dec": "12",
+    }
+    DAY_NUMBERS = frozenset("{:02d}".format(day) for day in range(1, 32))
+    DAYS_IN_MONTH = {
+        "01": 31, "02": 28, "03": 31, "04": 30, "05": 31, "06": 30,
+        "07": 31, "08": 31, "09": 30, "10": 31, "11": 30, "12": 31,
+    }
 
     def __init__(self, bank):
         self.bank = bank
-        self.ignore_line = ""
-        self.regexp_date = self.REGEXP_YEAR_MONTH_DAY
-        self.format_date = self.FORMAT_YEAR_MONTH_DAY
-        self.convert_date_with_month_string = False
-        if "santander" == self.bank:
-            self.transaction_position = 4
-            self.transaction_includes_currency = 'kr'
-            self.payee_position = 2
-            self.use_second_data = False
-            self.ignore_line = "Transaktioner ovan har du ännu inte fått på ditt kontoutdrag."
-        elif "skandia" == self.bank:
-            self.transaction_position = 2
-            self.transaction_includes_currency = ''
-            self.payee_position = 1
-            self.use_second_data = True
-        elif "ica" == self.bank:
-            self.transaction_position = 4
-            self.transaction_includes_currency = 'kr'
-            self.use_second_data = False
-            self.payee_position = 1
-        elif "ica2" == self.bank:
-            self.transaction_position = 4
-            self.transaction_includes_currency = 'kr'
-            self.use_second_data = False
-            self.payee_position = 1
-            self.regexp_date = self.REGEXP_DAY_MONTHSTRING_YEAR
-            self.convert_date_with_month_string = True
-            self.format_date = self.FORMAT_DAY_MONTH_YEAR_SPACES
-
-        else:
+        profile = BANK_PROFILES.get(bank)
+        if profile is None:
             raise Exception("Invalid bank" + self.bank)
 
-    def parse_outflow(self, line):
-
-        outflow = self.parse_transaction(line)
-        if '-' == outflow[0]:
-            return outflow[1:]
+        self.profile = profile
+        self.delimiter = profile.delimiter
+        self.transaction_position = profile.transaction_position
+        self.payee_position = profile.payee_position
+        self.transaction_includes_currency = profile.transaction_includes_currency
+        self.use_second_data = profile.use_second_data
+        self.regexp_date = profile.regexp_date
+        self.format_date = profile.format_date
+        self.convert_date_with_month_string = profile.convert_date_with_month_string
+        self.ignore_line = profile.ignore_line
+
+        self._compile_regexps()
+        self._compile_converter()
+
+    def _compile_regexps(self):
+        self.compiled_date = compile_regexp(self.regexp_date)
+        self.compiled_payee_date = compile_regexp(self.REGEXP_YEAR_MONTH_DAY)
+        self.fields = LineFields()
+        self.date_cache = DATE_CACHE
+
+    def _compile_converter(self):
+        # convert_line, convert_record and _convert_line_items specialised to the profile: its settings are bound
+        # as locals, and the ignore line and currency steps are left out for profiles without them
+        findall = self.compiled_date.findall
+        search_payee_date = self.compiled_payee_date.search
+        convert_date_string = self._convert_date_string
+        delimiter = self.delimiter
+        transaction_position = self.transaction_position
+        payee_position = self.payee_position
+        currency = self.transaction_includes_currency
+        date_index = 1 if self.use_second_data else 0
+        ignore_line = self.ignore_line
+        year_month_day_length = self.YEAR_MONTH_DAY_LENGTH
+
+        if len(currency) > 0:
+            def parse_transaction(items):
+                return items[transaction_position].replace(',', '.').replace(' ', '').replace(currency, '').strip()
         else:
-            return ""
-
-    def parse_inflow(self, line):
-
-        inflow = self.parse_transaction(line)
-        if '-' == inflow[0]:
-            return ""
-        else:
-            return inflow
-
-    def parse_transaction(self, line):
-
-        statement_items = line.split('\t')
-        outflow = statement_items[self.transaction_position]
-        outflow = outflow.replace(',', '.')
-        outflow = outflow.replace(' ', '')
-        outflow = outflow.replace(self.transaction_includes_currency, '')
-        outflow = outflow.strip()
-        return outflow
-
-    def remove_date_from_payee(self, line):
-
-        regexp = re.compile(self.REGEXP_YEAR_MONTH_DAY)
-        matches = regexp.findall(line)
-
-        if len(matches) > 0:
-            return line[self.YEAR_MONTH_DAY_LENGTH:]  # Remove date at the beginning of Payee
-
-        return line
-
-    def parse_payee(self, line):
-
-        statement_items = line.split('\t')
-        payee = statement_items[self.payee_position]  # Get Payee from list, date is stored in index 0
-        payee = payee.replace(',', '.')
-        payee = payee.replace('\\\\', ' ')
-        payee = payee.replace('\\', '')
-        payee = payee.strip()  # Remove trailing with space
-        payee = self.remove_date_from_payee(payee)
-
-        return payee
-
-    def parse_date(self, line):
-
-        date_year_month_day = self._parse_year_month_day(line)
-        date_day_month_year = self._convert_date_string(date_year_month_day)
-
-        return date_day_month_year
-
-    def _parse_year_month_day(self, line):
-        regexp = re.compile(self.regexp_date)
-        matches = regexp.findall(line)
-
-        date_year_month_day = ""
-        if (len(matches) == 1):
-            date_year_month_day = matches[0]
-        elif (len(matches) == 2):
-            if self.use_second_data:
-                date_year_month_day = matches[1]
+            def parse_transaction(items):
+                return items[transaction_position].replace(',', '.').replace(' ', '').strip()
+
+        def convert_line_items(line):
+            matches = findall(line)
+            if 1 == len(matches):
+                date = convert_date_string(matches[0])
+            elif 2 == len(matches):
+                date = convert_date_string(matches[date_index])
             else:
-                date_year_month_day = matches[0]
+                raise Exception("Invalid number of dates found in line: " + line)
+            items = line.split(delimiter)
+            payee = items[payee_position].replace(',', '.').replace('\\\\', ' ').replace('\\', '').strip()
+            if search_payee_date(payee) is not None:
+                payee = payee[year_month_day_length:]  # Remove date at the beginning of Payee
+            transaction = parse_transaction(items)
+            if '-' == transaction[0]:
+                return date, payee, transaction[1:], "", transaction
+            return date, payee, "", transaction, transaction
+
+        if len(ignore_line) > 0:
+            def convert_line(line):
+                if ignore_line in line:
+                    return ""
+                date, payee, outflow, inflow, transaction = convert_line_items(line)
+                return "".join((date, ",", payee, ",", ",", ",", outflow, ",", inflow, "\n"))
+
+            def convert_record(line):
+                if ignore_line in line:
+                    return None
+                date, payee, outflow, inflow, transaction = convert_line_items(line)
+                return Transaction(date, payee, outflow, inflow, amount_to_ore(transaction))
         else:
-            raise Exception("Invalid number of dates found in line: " + line)
+            def convert_line(line):
+                date, payee, outflow, inflow, transaction = convert_line_items(line)
+                return "".join((date, ",", payee, ",", ",", ",", outflow, ",", inflow, "\n"))
 
-        return date_year_month_day
+            def convert_record(line):
+                date, payee, outflow, inflow, transaction = convert_line_items(line)
+                return Transaction(date, payee, outflow, inflow, amount_to_ore(transaction))
 
-    def _convert_date_with_month_string(self, extracted_date_as_string):
-        month_string = self._extract_month_string(extracted_date_as_string)
-        month_number = self._convert_month_string_to_month_number(month_string)
-        result = extracted_date_as_string.replace(month_string, month_number)
-        return result
+        self._convert_line_items = convert_line_items
+        self.convert_line = convert_line
+        self.convert_record = convert_record
 
-    def _convert_month_string_to_month_number(self, month_string):
-        if month_string == "jan":
-            return "01"
-        if month_string == "feb":
-            return "02"
-        if month_string == "mar":
-            return "03"
-        if month_string == "apr":
-            return "04"
-        if month_string == "maj":
-            return "05"
-        if month_string == "jun":
-            return "06"
-        if month_string == "jul":
-            return "07"
-        if month_string == "aug":
-            return "08"
-        if month_string == "sep":
-            return "09"
-        if month_string == "okt":
-            return "10"
-        if month_string == "nov":
-            return "11"
-        if month_string == "dec":
-            return "12"
-        raise Exception("Cannot convert month string to month number: " + month_string)
-
-    def _extract_month_string(self, extracted_date_as_string):
-        regexp = re.compile("[a-ö]{3,3}")
-        matches = regexp.findall(extracted_date_as_string)
-        month_string = matches[0]
-        return month_string
-
-    def _convert_date_string(self, extracted_date_as_string):
-        if self.convert_date_with_month_string:
-            extracted_date_as_string = self._convert_date_with_month_string(extracted_date_as_string)
-
-        extracted_date = time.strptime(extracted_date_as_string, self.format_date)
-        extracted_date_as_string_day_month_year = time.strftime(self.FORMAT_DAY_MONTH_YEAR, extracted_date)
-        return extracted_date_as_string_day_month_year
-
-    def convert_line(self, line):
-        if ((len(self.ignore_line) > 0) and (self.ignore_line in line)):
-            return ""
-        # Date,Payee,Category,Memo,Outflow,Inflow
-        out_line = ""
-        out_line += self.parse_date(line) + ","
-        out_line += self.parse_payee(line) + ","
-        out_line += ","  # Category
-        out_line += ","  # Memo
-        out_line += self.parse_outflow(line) + ","
-        out_line += self.parse_inflow(line) + "\n"
-        return out_line
-
-
-class IcaLineConverter:
-    REGEXP_YEAR_MONTH_DAY = r"\d\d\d\d-\d\d-\d\d"
-    REGEXP_DAY_MONTHSTRING_YEAR = r"\d\d [a-ö]{3,3} \d\d\d\d"
-    FORMAT_YEAR_MONTH_DAY = "%Y-%m-%d"
-    FORMAT_DAY_MONTH_YEAR = "%d/%m/%Y"
-    FORMAT_DAY_MONTH_YEAR_SPACES = "%d %m %Y"
-    YEAR_MONTH_DAY_LENGTH = 11
-
-    def __init__(self, bank):
-        self.bank = bank
-        self.ignore_line = ""
-        self.regexp_date = self.REGEXP_YEAR_MONTH_DAY
-        self.format_date = self.FORMAT_YEAR_MONTH_DAY
-        self.convert_date_with_month_string = False
-        if "ica2" == self.bank:
-            self.transaction_position = 4
-            self.transaction_includes_currency = 'kr'
-            self.use_second_data = False
-            self.payee_position = 1
-
-        else:
-            raise Exception("Invalid bank" + self.bank)
+    def tokenize_line(self, line):
+        return self.fields.load(line, self.delimiter)
 
     def parse_outflow(self, line):
 
-        outflow = self.parse_transaction(line)
+        return self._outflow_from_transaction(self.parse_transaction(line))
+
+    def _outflow_from_transaction(self, outflow):
         if '-' == outflow[0]:
             return outflow[1:]
         else:
@@ -301,7 +1606,9 @@ class IcaLineConverter:
 
     def parse_inflow(self, line):
 
-        inflow = self.parse_transaction(line)
+        return self._inflow_from_transaction(self.parse_transaction(line))
+
+    def _inflow_from_transaction(self, inflow):
         if '-' == inflow[0]:
             return ""
         else:
@@ -309,8 +1616,10 @@ class IcaLineConverter:
 
     def parse_transaction(self, line):
 
-        statement_items = line.split(';')
-        outflow = statement_items[self.transaction_position]
+        return self._parse_transaction_fields(self.tokenize_line(line))
+
+    def _parse_transaction_fields(self, fields):
+        outflow = fields.items[self.transaction_position]
         outflow = outflow.replace(',', '.')
         outflow = outflow.replace(' ', '')
         outflow = outflow.replace(self.transaction_includes_currency, '')
@@ -319,18 +1628,17 @@ class IcaLineConverter:
 
     def remove_date_from_payee(self, line):
 
-        regexp = re.compile(self.REGEXP_YEAR_MONTH_DAY)
-        matches = regexp.findall(line)
-
-        if len(matches) > 0:
+        if self.compiled_payee_date.search(line) is not None:
             return line[self.YEAR_MONTH_DAY_LENGTH:]  # Remove date at the beginning of Payee
 
         return line
 
     def parse_payee(self, line):
 
-        statement_items = line.split(';')
-        payee = statement_items[self.payee_position]  # Get Payee from list, date is stored in index 0
+        return self._parse_payee_fields(self.tokenize_line(line))
+
+    def _parse_payee_fields(self, fields):
+        payee = fields.items[self.payee_position]  # Get Payee from list, date is stored in index 0
         payee = payee.replace(',', '.')
         payee = payee.replace('\\\\', ' ')
         payee = payee.replace('\\', '')
@@ -347,8 +1655,7 @@ class IcaLineConverter:
         return date_day_month_year
 
     def _parse_year_month_day(self, line):
-        regexp = re.compile(self.regexp_date)
-        matches = regexp.findall(line)
+        matches = self.compiled_date.findall(line)
 
         date_year_month_day = ""
         if (len(matches) == 1):
@@ -364,100 +1671,775 @@ class IcaLineConverter:
         return date_year_month_day
 
     def _convert_date_with_month_string(self, extracted_date_as_string):
-        month_string = self._extract_month_string(extracted_date_as_string)
-        month_number = self._convert_month_string_to_month_number(month_string)
-        result = extracted_date_as_string.replace(month_string, month_number)
-        return result
+        # "dd mmm yyyy" maps straight to "dd/mm/yyyy" without regexp or strptime
+        day = extracted_date_as_string[0:2]
+        month_number = self._convert_month_string_to_month_number(extracted_date_as_string[3:6])
+        year = extracted_date_as_string[7:11]
+        if day not in self.DAY_NUMBERS or int(day) > self._days_in_month(month_number, year):
+            raise Exception("Invalid day of month in date: " + extracted_date_as_string)
+        return day + "/" + month_number + "/" + year
+
+    def _days_in_month(self, month_number, year):
+        if "02" == month_number and year.isdecimal():
+            year = int(year)
+            if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+                return 29
+        return self.DAYS_IN_MONTH[month_number]
 
     def _convert_month_string_to_month_number(self, month_string):
-        if month_string == "jan":
-            return "01"
-        if month_string == "feb":
-            return "02"
-        if month_string == "mar":
-            return "03"
-        if month_string == "apr":
-            return "04"
-        if month_string == "maj":
-            return "05"
-        if month_string == "jun":
-            return "06"
-        if month_string == "jul":
-            return "07"
-        if month_string == "aug":
-            return "08"
-        if month_string == "sep":
-            return "09"
-        if month_string == "okt":
-            return "10"
-        if month_string == "nov":
-            return "11"
-        if month_string == "dec":
-            return "12"
-        raise Exception("Cannot convert month string to month number: " + month_string)
-
-    def _extract_month_string(self, extracted_date_as_string):
-        regexp = re.compile("[a-ö]{3,3}")
-        matches = regexp.findall(extracted_date_as_string)
-        month_string = matches[0]
-        return month_string
+        month_number = self.MONTH_NUMBERS.get(month_string.lower())
+        if month_number is None:
+            raise Exception("Cannot convert month string to month number: " + month_string)
+        return month_number
 
     def _convert_date_string(self, extracted_date_as_string):
+        cached = self.date_cache.get(extracted_date_as_string, self.format_date)
+        if cached is not None:
+            return cached
+
+        converted = self._convert_date_string_uncached(extracted_date_as_string)
+        self.date_cache.put(extracted_date_as_string, self.format_date, converted)
+        return converted
+
+    def _convert_date_string_uncached(self, extracted_date_as_string):
         if self.convert_date_with_month_string:
-            extracted_date_as_string = self._convert_date_with_month_string(extracted_date_as_string)
+            return self._convert_date_with_month_string(extracted_date_as_string)
 
         extracted_date = time.strptime(extracted_date_as_string, self.format_date)
         extracted_date_as_string_day_month_year = time.strftime(self.FORMAT_DAY_MONTH_YEAR, extracted_date)
         return extracted_date_as_string_day_month_year
 
-    def convert_line(self, line):
+    def convert_records(self, lines):
+        convert_record = self.convert_record
+        return [transaction for transaction in map(convert_record, lines) if transaction is not None]
+
+    def convert_line_instrumented(self, line, stats):
+        # Same as convert_line, with the time per stage added to stats
         if ((len(self.ignore_line) > 0) and (self.ignore_line in line)):
             return ""
-        # Date,Payee,Category,Memo,Outflow,Inflow
-        out_line = ""
-        out_line += self.parse_date(line) + ","
-        out_line += self.parse_payee(line) + ","
-        out_line += ","  # Category
-        out_line += ","  # Memo
-        out_line += self.parse_outflow(line) + ","
-        out_line += self.parse_inflow(line) + "\n"
-        return out_line
+        perf_counter = time.perf_counter
+        start = perf_counter()
+        date = self.parse_date(line)
+        date_done = perf_counter()
+        fields = self.tokenize_line(line)
+        payee = self._parse_payee_fields(fields)
+        payee_done = perf_counter()
+        transaction = self._parse_transaction_fields(fields)
+        outflow = self._outflow_from_transaction(transaction)
+        inflow = self._inflow_from_transaction(transaction)
+        amount_done = perf_counter()
+        stats.seconds["date"] += date_done - start
+        stats.seconds["payee"] += payee_done - date_done
+        stats.seconds["amount"] += amount_done - payee_done
+        return "".join((date, ",", payee, ",", ",", ",", outflow, ",", inflow, "\n"))
+
+
+class IcaLineConverter(GeneralLineConverter):
+    # Former name of the ';' separated ica2 export, now the ica2_semicolon bank
+    BANKS = {"ica2": "ica2_semicolon", "ica2_semicolon": "ica2_semicolon"}
+
+    def __init__(self, bank):
+        if bank not in self.BANKS:
+            raise Exception("Invalid bank" + bank)
+        super().__init__(self.BANKS[bank])
+
+
+class ResultCache:
+    # Converted files keyed by the hash of input, bank profile and converter version, least recently used
+    # evicted beyond max_size; entries are read-only since link hard links them to the output file
+    DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, link=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.link = link
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, input_file, bank, compression=None):
+        import hashlib
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update("{}\n{}\n".format(CONVERTER_VERSION, BANK_PROFILES[bank]).encode('utf-8'))
+        if None != compression:
+            digest.update("{}\n".format(compression).encode('utf-8'))
+        with open(input_file, 'rb') as f_input:
+            for block in iter(lambda: f_input.read(self.READ_SIZE), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".csv")
+
+    def restore(self, key, output_file):
+        cached_file = self.path(key)
+        if not os.path.isfile(cached_file):
+            return False
+        if os.path.isfile(output_file):
+            raise ErrorOutputFileAlreadyExists("Output file name already exists")
+        if not (self.link and self._link(cached_file, output_file)):
+            import shutil
+            temporary_file = output_file + FileWriter.TEMPORARY_SUFFIX
+            shutil.copyfile(cached_file, temporary_file)  # Only the content, the copy is writable
+            os.replace(temporary_file, output_file)
+        os.utime(cached_file)  # Most recently used
+        return True
+
+    def _link(self, cached_file, output_file):
+        try:
+            os.link(cached_file, output_file)
+        except OSError:
+            return False  # Another file system, or one without hard links
+        return True
+
+    def store(self, key, output_file):
+        import shutil
+        temporary_file = self.path(key) + ".{}.tmp".format(os.getpid())
+        shutil.copyfile(output_file, temporary_file)
+        os.chmod(temporary_file, 0o444)  # Hard linked output files must not change the cached result
+        os.replace(temporary_file, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".csv"):
+                continue
+            try:
+                status = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue  # Evicted by a concurrent conversion
+            entries.append((status.st_mtime, status.st_size, name))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+ConversionJob = namedtuple("ConversionJob", ["bank", "input_file", "output_file"])
+ConversionResult = namedtuple("ConversionResult", ["input_file", "output_file", "success", "message"])
+
+
+def convert_file(bank, input_file, output_file=None, batch_size=StatementConverter.DEFAULT_BATCH_SIZE,
+                 buffer_size=DEFAULT_BUFFER_SIZE, workers=None, use_mmap=False, stats=None,
+                 incremental=False, deduplicator=None, result_cache=None, compression=None, rejected_lines=None,
+                 checkpoint_interval=None, output_format="csv"):
+    if AUTO_BANK == bank:
+        bank = sniff_bank(input_file)
+    writer_class = OUTPUT_FORMATS[output_format].writer_class
+    if None == output_file:
+        output_file = OutputFileName().create_output_file_name(input_file, compression,
+                                                               OUTPUT_FORMATS[output_format].suffix)
+    if FileWriter != writer_class:
+        if incremental or None != deduplicator or None != checkpoint_interval or None != stats:
+            raise Exception("Incremental conversion, deduplication, checkpoints and statistics need csv output")
+        workers = None  # Chunks are converted to csv text
+        result_cache = None
+    streaming_input = STDIO_FILE_NAME == input_file
+    streaming_output = STDIO_FILE_NAME == output_file
+    if streaming_input or None != sniff_compression(input_file):
+        # A pipe or a compressed stream can neither be memory mapped nor split into chunks
+        use_mmap = False
+        workers = None
+    if incremental and streaming_output:
+        raise Exception("Incremental conversion needs an output file, not stdout")
+    checkpoint = None
+    if None != checkpoint_interval:
+        if streaming_input or streaming_output or incremental:
+            raise Exception("Checkpoints need an input and an output file, and no incremental conversion")
+        if None != (compression or compression_from_file_name(output_file)):
+            raise Exception("Checkpoints need an uncompressed output file")
+        if None != deduplicator:
+            raise Exception("Checkpoints cannot be combined with deduplication, its state is not saved")
+        checkpoint = ConversionCheckpoint.for_output_file(output_file, input_file, bank, checkpoint_interval)
+        use_mmap = False  # Offsets come from FileReader.tell()
+        workers = None
+
+    cache_key = None
+    cacheable = not (incremental or streaming_input or streaming_output) and None == deduplicator
+    cacheable = cacheable and None == rejected_lines  # Never hand out an output missing rejected lines
+    if None != result_cache and cacheable:
+        output_compression = compression or compression_from_file_name(output_file)
+        cache_key = result_cache.key(input_file, bank, compression=output_compression)
+        if result_cache.restore(cache_key, output_file):
+            return output_file
+
+    fingerprint_index = None
+    if incremental:
+        fingerprint_index = FingerprintIndex.for_output_file(output_file)
+        if os.path.isfile(output_file) and not os.path.isfile(fingerprint_index.file_name):
+            raise ErrorOutputFileAlreadyExists("Output file name already exists without fingerprint index")
+        if not os.path.isfile(output_file):
+            fingerprint_index.discard()  # Left behind by a deleted output file, every line is new again
+        workers = None  # Only the lines missing from the index are read, so there is nothing to split
+
+    statement_line_converter = GeneralLineConverter(bank)
+    if use_mmap:
+        file_reader = MmapFileReader(input_file)
+    else:
+        file_reader = FileReader(input_file, buffer_size, seekable=None != checkpoint)
+    if None != fingerprint_index:
+        file_reader = NewLinesReader(file_reader, fingerprint_index)
+        if None != rejected_lines:
+            rejected_lines.on_reject = fingerprint_index.forget
+
+    resume_offset = None
+    if None != checkpoint:
+        resume_offset = checkpoint.resume_offset(output_file + FileWriter.TEMPORARY_SUFFIX, rejected_lines)
+        if None != resume_offset:
+            file_reader.seek(checkpoint.input_offset)
+            if None != rejected_lines:
+                rejected_lines.resume(checkpoint.rejected_lines_state())
+    if None != rejected_lines and None == resume_offset:
+        rejected_lines.remove()
+    if FileWriter == writer_class:
+        # Written under a temporary name and renamed into place once complete, appends go to the output file
+        file_writer = FileWriter(output_file, buffer_size, append=incremental, compression=compression, atomic=True,
+                                 resume_offset=resume_offset)
+    else:
+        file_writer = writer_class(output_file, buffer_size, compression)
+    converter_writer = file_writer
+    if None != checkpoint:
+        converter_writer = CheckpointingWriter(file_writer, file_reader, checkpoint, rejected_lines)
+
+    statement_converter = StatementConverter(statement_line_converter, file_reader, converter_writer, batch_size,
+                                             workers, stats, deduplicator, rejected_lines)
+    statement_converter.convert()
+    file_writer.commit()
+
+    if None != checkpoint:
+        checkpoint.remove()
+    if None != fingerprint_index:
+        fingerprint_index.save()  # Only record lines in the index once they are in the output file
+    if None != cache_key:
+        result_cache.store(cache_key, output_file)
+    return output_file
+
+
+def convert_job(job, batch_size=StatementConverter.DEFAULT_BATCH_SIZE, buffer_size=DEFAULT_BUFFER_SIZE,
+                result_cache=None, deduplicator=None):
+    try:
+        output_file = convert_file(job.bank, job.input_file, job.output_file, batch_size, buffer_size,
+                                   result_cache=result_cache, deduplicator=deduplicator)
+    except Exception as error:
+        message = getattr(error, "message", str(error))
+        return ConversionResult(job.input_file, job.output_file, False, message)
+    return ConversionResult(job.input_file, output_file, True, "")
+
+
+def _convert_job_with_settings(job_and_settings):
+    job, batch_size, buffer_size, result_cache = job_and_settings
+    return convert_job(job, batch_size, buffer_size, result_cache)
+
+
+def read_manifest(manifest_file):
+    # One job per line: bank,input_file[,output_file]
+    jobs = []
+    with open(manifest_file, 'r') as f_manifest:
+        for line in f_manifest:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            items = [item.strip() for item in line.split(',')]
+            output_file = items[2] if len(items) > 2 and len(items[2]) > 0 else None
+            jobs.append(ConversionJob(items[0], items[1], output_file))
+    return jobs
+
+
+def collect_conversion_jobs(bank, sources):
+    import glob
+    jobs = []
+    for source in sources:
+        if os.path.isdir(source):
+            input_files = sorted(glob.glob(os.path.join(source, "*.txt")))
+        else:
+            input_files = sorted(glob.glob(source)) or [source]
+        for input_file in input_files:
+            jobs.append(ConversionJob(bank, input_file, None))
+    return jobs
+
+
+def convert_jobs(jobs, workers=None, batch_size=StatementConverter.DEFAULT_BATCH_SIZE,
+                 buffer_size=DEFAULT_BUFFER_SIZE, result_cache=None, deduplicator=None):
+    if workers == 1 or None != deduplicator:
+        # A shared deduplicator converts the jobs one after another, earlier jobs keep their transactions
+        return [convert_job(job, batch_size, buffer_size, result_cache, deduplicator) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    jobs_and_settings = [(job, batch_size, buffer_size, result_cache) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_convert_job_with_settings, jobs_and_settings, chunksize=8))
+
+
+def write_batch_report(results, report_file):
+    with open(report_file, 'w') as f_report:
+        f_report.write("input_file,output_file,status,message\n")
+        for result in results:
+            status = "ok" if result.success else "failed"
+            f_report.write("{},{},{},{}\n".format(result.input_file, result.output_file or "", status,
+                                                  result.message.replace(',', ' ')))
+
+
+def create_result_cache(args):
+    if None == args.cache_dir:
+        return None
+    return ResultCache(args.cache_dir, args.cache_size * 1024 * 1024, args.cache_link)
+
+
+def add_bank_argument(parser):
+    parser.add_argument("--bank", default=AUTO_BANK,
+                        help="bank used for all sources: " + ", ".join(sorted(BANK_PROFILES)) +
+                             " (default: detected per file)")
+
+
+def add_cache_arguments(parser):
+    parser.add_argument("--cache_dir", default=None,
+                        help="reuse converted files for unchanged input files, stored in this directory")
+    parser.add_argument("--cache_size", type=int, default=ResultCache.DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help="maximum result cache size in MiB (default: {})".format(
+                            ResultCache.DEFAULT_MAX_SIZE // (1024 * 1024)))
+    parser.add_argument("--cache_link", action="store_true",
+                        help="hard link cached results instead of copying them, the output files are then "
+                             "read-only (copied when the cache is on another file system)")
+
+
+def add_dedup_arguments(parser):
+    parser.add_argument("--dedup_index", default=None,
+                        help="drop transactions with the same date, payee and amount as a statement converted "
+                             "earlier with this index file, and remember the new ones in it")
+    parser.add_argument("--dedup_capacity", type=int, default=TransactionDeduplicator.DEFAULT_CAPACITY,
+                        help="number of transactions the deduplication filter is sized for, it grows when the index "
+                             "is saved fuller (default: {})".format(TransactionDeduplicator.DEFAULT_CAPACITY))
+
+
+def positive_int(text):
+    # Argument type for sizes, a buffer size of 0 would mean unbuffered files
+    import argparse
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1: {}".format(text))
+    return value
+
+
+def parse_batch_command_line_arguments(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="parsebankstatement batch")
+    parser.add_argument("sources", nargs='*',
+                        help="input files, directories (all .txt files) or glob patterns")
+    add_bank_argument(parser)
+    parser.add_argument("--manifest",
+                        help="file with one job per line: bank,input_file[,output_file]", default=None)
+    parser.add_argument("--workers", type=int,
+                        help="number of worker processes (default: number of CPUs)", default=None)
+    parser.add_argument("--report", help="write a csv report with one row per input file", default=None)
+    parser.add_argument("--dedup", action="store_true",
+                        help="drop transactions with the same date, payee and amount as an earlier file of the batch, "
+                             "the files are then converted one after another in the given order")
+    add_dedup_arguments(parser)
+    parser.add_argument("--batch_size", type=int, default=StatementConverter.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--buffer_size", type=positive_int, default=DEFAULT_BUFFER_SIZE)
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+    if len(args.sources) == 0 and None == args.manifest:
+        parser.error("give sources or --manifest")
+
+    return args
+
+
+def batch_main(argv):
+    args = parse_batch_command_line_arguments(argv)
+
+    jobs = []
+    if None != args.manifest:
+        jobs += read_manifest(args.manifest)
+    jobs += collect_conversion_jobs(args.bank, args.sources)
+
+    deduplicator = None
+    if args.dedup or None != args.dedup_index:
+        deduplicator = TransactionDeduplicator(args.dedup_index, args.dedup_capacity)
+    results = convert_jobs(jobs, args.workers, args.batch_size, args.buffer_size, create_result_cache(args),
+                           deduplicator)
+    for result in results:
+        if result.success:
+            print("OK.....: {} -> {}".format(result.input_file, result.output_file))
+        else:
+            print("FAILED.: {}: {}".format(result.input_file, result.message))
+    if None != deduplicator:
+        print("Duplicates.: {}".format(deduplicator.duplicates))
+        if None != args.dedup_index:
+            deduplicator.save()
+
+    failed_count = len([result for result in results if not result.success])
+    print("Converted {} of {} files".format(len(results) - failed_count, len(results)))
+
+    if None != args.report:
+        write_batch_report(results, args.report)
+
+    return 1 if failed_count > 0 else 0
+
+
+def parse_ledger_command_line_arguments(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="parsebankstatement ledger")
+    parser.add_argument("ledger_file", help="SQLite ledger database, created if missing")
+    parser.add_argument("sources", nargs='+',
+                        help="input files, directories (all .txt files) or glob patterns, - reads stdin")
+    add_bank_argument(parser)
+    parser.add_argument("--source", default=None,
+                        help="name of the statement read from stdin, needed with -, loading the same name again "
+                             "replaces it")
+    parser.add_argument("--batch_size", type=int, default=StatementConverter.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--buffer_size", type=positive_int, default=DEFAULT_BUFFER_SIZE)
+    args = parser.parse_args(argv)
+    if STDIO_FILE_NAME in args.sources and None == args.source:
+        parser.error("give --source NAME to load a statement from stdin")
+
+    return args
+
+
+def ledger_main(argv):
+    args = parse_ledger_command_line_arguments(argv)
+
+    ledger = Ledger(args.ledger_file)
+    failed_count = 0
+    jobs = collect_conversion_jobs(args.bank, args.sources)
+    for job in jobs:
+        try:
+            source = args.source if STDIO_FILE_NAME == job.input_file else None
+            count = load_into_ledger(ledger, job.bank, job.input_file, args.batch_size, args.buffer_size,
+                                     source=source)
+        except Exception as error:
+            failed_count += 1
+            print("FAILED.: {}: {}".format(job.input_file, getattr(error, "message", str(error))))
+            continue
+        print("OK.....: {} ({} transactions)".format(job.input_file, count))
+    ledger.close()
+
+    print("Loaded {} of {} files".format(len(jobs) - failed_count, len(jobs)))
+    return 1 if failed_count > 0 else 0
+
+
+def parse_query_command_line_arguments(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="parsebankstatement query")
+    parser.add_argument("ledger_file", help="SQLite ledger database filled by the ledger command")
+    parser.add_argument("--from", dest="date_from", default=None, help="first date, yyyy-mm-dd")
+    parser.add_argument("--to", dest="date_to", default=None, help="last date, yyyy-mm-dd")
+    parser.add_argument("--payee", default=None, help="payee, case insensitive, %% matches any text")
+    parser.add_argument("--bank", default=None, help="only transactions from this bank")
+    parser.add_argument("--monthly", action="store_true",
+                        help="print the number of transactions and the sum per month (whole months) instead")
+    parser.add_argument("--limit", type=int, default=None, help="print at most this many transactions")
+    return parser.parse_args(argv)
+
+
+def query_main(argv):
+    args = parse_query_command_line_arguments(argv)
+    if not os.path.isfile(args.ledger_file):
+        print("No ledger: {}".format(args.ledger_file), file=sys.stderr)
+        return 1
+
+    ledger = Ledger(args.ledger_file)
+    if args.monthly:
+        print("Month,Transactions,Amount")
+        for month, count, amount in ledger.monthly_sums(args.date_from, args.date_to, args.payee, args.bank):
+            print("{},{},{}".format(month, count, ore_to_amount(amount)))
+    else:
+        print("Date,Payee,Amount,Bank")
+        for date, payee, amount, bank in ledger.transactions(args.date_from, args.date_to, args.payee, args.bank,
+                                                             args.limit):
+            print("{},{},{},{}".format(date, payee, ore_to_amount(amount), bank))
+    ledger.close()
+    return 0
+
+
+class ConversionServer:
+    # POST /convert?bank=<bank> streams the uploaded statement back as chunked csv, with preloaded line converters
+    DEFAULT_PORT = 8080
+    DEFAULT_MAX_CONNECTIONS = 16
+    READ_SIZE = 64 * 1024
+    MAX_LINE_SIZE = 64 * 1024  # Same as the limit of the request and header lines
+    DEFAULT_IDLE_TIMEOUT = 30.0  # For the request headers, and for every read and write after them
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        # convert_line never awaits, so one converter per bank is shared by all connections
+        self.line_converters = {bank: GeneralLineConverter(bank) for bank in BANK_PROFILES}
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.semaphore = None
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        import asyncio
+        self.semaphore = asyncio.Semaphore(self.max_connections)
+        if None != unix_path:
+            return await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def serve_forever(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        server = await self.start(host, port, unix_path)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        import asyncio
+        try:
+            try:
+                request = await asyncio.wait_for(self._read_request(reader, writer), self.idle_timeout)
+            except asyncio.TimeoutError:
+                return await self._send_error(writer, 408, "Request Timeout", "No complete request headers")
+            if None == request:
+                return  # Already answered
+            line_converter, content_length, expect_continue = request
+            # Only conversions wait for each other, clients that are slow to send their headers time out instead
+            async with self.semaphore:
+                if expect_continue:
+                    # curl waits a second for this before it sends a large upload
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                await self._convert_upload(reader, writer, line_converter, content_length)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        # (line converter, content length, expect 100-continue) of a conversion, None once answered otherwise
+        from urllib.parse import parse_qs, urlsplit
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                header_line = (await reader.readline()).decode('latin-1').strip()
+                if len(header_line) == 0:
+                    break
+                name, _, value = header_line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        except ValueError:
+            # readline raises ValueError for a line longer than the stream limit
+            return await self._send_error(writer, 431, "Request Header Fields Too Large", "Request line too long")
+
+        if len(request_line) < 2:
+            return await self._send_error(writer, 400, "Bad Request", "Invalid request line")
+        method, target = request_line[0], urlsplit(request_line[1])
+        if "GET" == method and "/health" == target.path:
+            return await self._send_error(writer, 200, "OK", "ok")
+        if "POST" != method or "/convert" != target.path:
+            return await self._send_error(writer, 404, "Not Found", "Use POST /convert?bank=<bank>")
+
+        bank = parse_qs(target.query).get("bank", [""])[0]
+        line_converter = self.line_converters.get(bank)
+        if None == line_converter:
+            return await self._send_error(writer, 400, "Bad Request", "Invalid bank" + bank)
+        if not headers.get("content-length", "").isdigit():
+            return await self._send_error(writer, 411, "Length Required", "Content-Length is required")
+        return line_converter, int(headers["content-length"]), "100-continue" == headers.get("expect", "").lower()
+
+    async def _convert_upload(self, reader, writer, line_converter, remaining):
+        import asyncio
+        started = False
+        pending = b""
+        while True:
+            data = pending
+            if remaining > 0:
+                block = await asyncio.wait_for(reader.read(min(remaining, self.READ_SIZE)), self.idle_timeout)
+                if len(block) == 0:
+                    raise asyncio.IncompleteReadError(pending, remaining)
+                remaining -= len(block)
+                data += block
+            # Only convert whole lines until the upload is complete
+            cut = len(data) if remaining <= 0 else data.rfind(b"\n") + 1
+            pending = data[cut:]
+            if len(pending) > self.MAX_LINE_SIZE:
+                if started:
+                    return  # Closing without the final chunk tells the client the csv is incomplete
+                return await self._send_error(writer, 413, "Payload Too Large",
+                                              "Line longer than {} bytes".format(self.MAX_LINE_SIZE))
+            if 0 == cut and remaining > 0:
+                continue  # No whole line yet, the response only starts once there is something to convert
+
+            try:
+                converted = "".join(map(line_converter.convert_line, decode_lines(data[:cut], 'utf-8')))
+            except Exception as error:
+                if started:
+                    return  # Closing without the final chunk tells the client the csv is incomplete
+                message = getattr(error, "message", str(error))
+                return await self._send_error(writer, 400, "Bad Request", message)
+            if not started:
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/csv; charset=utf-8\r\n"
+                             b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+                converted = "Date,Payee,Category,Memo,Outflow,Inflow\n" + converted
+                started = True
+            self._write_chunk(writer, converted.encode('utf-8'))
+            # Backpressure: do not read more than the client takes
+            await asyncio.wait_for(writer.drain(), self.idle_timeout)
+            if remaining <= 0:
+                break
+
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def _write_chunk(self, writer, data):
+        if len(data) > 0:
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    async def _send_error(self, writer, status, reason, message):
+        body = (message + "\n").encode('utf-8')
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Length: {}\r\n"
+                     "Connection: close\r\n\r\n".format(status, reason, len(body)).encode('latin-1') + body)
+        await writer.drain()
+
+
+def parse_serve_command_line_arguments(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="parsebankstatement serve")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=ConversionServer.DEFAULT_PORT,
+                        help="port to listen on (default: {})".format(ConversionServer.DEFAULT_PORT))
+    parser.add_argument("--unix_socket", default=None, help="listen on this unix socket instead of tcp")
+    parser.add_argument("--max_connections", type=int, default=ConversionServer.DEFAULT_MAX_CONNECTIONS,
+                        help="conversions running at the same time (default: {})".format(
+                            ConversionServer.DEFAULT_MAX_CONNECTIONS))
+    parser.add_argument("--idle_timeout", type=float, default=ConversionServer.DEFAULT_IDLE_TIMEOUT,
+                        help="seconds a client may take to send its request headers, and may stall while "
+                             "uploading or reading the csv (default: {})".format(
+                            ConversionServer.DEFAULT_IDLE_TIMEOUT))
+    return parser.parse_args(argv)
+
+
+def serve_main(argv):
+    import asyncio
+    args = parse_serve_command_line_arguments(argv)
+    server = ConversionServer(args.max_connections, args.idle_timeout)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
 
 
 def parse_command_line_arguments():
+    import argparse
     # Setup the argument parser
-    parser = argparse.ArgumentParser()
-    parser.add_argument("bank", help="valid banks: santander, skandia, ica")
-    parser.add_argument("input_file", help="text file with bank statement from the bank")
+    parser = argparse.ArgumentParser(epilog="use 'batch' as first argument to convert many files in parallel, "
+                                            "'serve' to run a conversion http service, 'ledger' to load "
+                                            "statements into a SQLite ledger and 'query' to search it")
+    parser.add_argument("bank", help="valid banks: " + ", ".join(sorted(BANK_PROFILES)) +
+                                     ", or " + AUTO_BANK + " to detect it from the start of the input file")
+    parser.add_argument("input_file", help="text file with bank statement from the bank, - reads stdin")
+    parser.add_argument("output", nargs='?', default=None, help="same as --output_file")
     parser.add_argument("--output_file",
-                        help="csv file to be consumed by YNAB (default: same name as input file but with .csv postfix)",
+                        help="csv file to be consumed by YNAB, - writes stdout (default: same name as input file "
+                             "but with .csv postfix, stdout when reading stdin)",
                         default=None)
+    parser.add_argument("--batch_size", type=int,
+                        help="number of lines converted and written per batch, 0 converts line by line "
+                             "(default: {})".format(StatementConverter.DEFAULT_BATCH_SIZE),
+                        default=StatementConverter.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--buffer_size", type=positive_int,
+                        help="read and write buffer size in bytes (default: {})".format(DEFAULT_BUFFER_SIZE),
+                        default=DEFAULT_BUFFER_SIZE)
+    parser.add_argument("--workers", type=int,
+                        help="convert chunks of one large input file in this many worker processes (default: 1)",
+                        default=1)
+    parser.add_argument("--mmap", action="store_true",
+                        help="read the input file through a memory map instead of buffered reads")
+    parser.add_argument("--incremental", action="store_true",
+                        help="append only lines not converted before, tracked in <output_file>.idx")
+    add_dedup_arguments(parser)
+    add_cache_arguments(parser)
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default="csv",
+                        help="output format, YNAB csv or transaction records as json lines, a SQLite database, "
+                             "an Arrow or a Parquet file (Arrow and Parquet need pyarrow) (default: csv)")
+    parser.add_argument("--compress", choices=sorted(COMPRESSION_SUFFIXES.values()), default=None,
+                        help="compress the output (default: by output file suffix, compressed input is always "
+                             "detected)")
+    parser.add_argument("--tolerant", action="store_true",
+                        help="write lines that cannot be converted to a sidecar file instead of stopping")
+    parser.add_argument("--rejected_file", default=None,
+                        help="sidecar file for rejected lines (default: <output_file>{}, stderr when writing "
+                             "stdout)".format(RejectedLines.FILE_SUFFIX))
+    parser.add_argument("--max_error_rate", type=float, default=RejectedLines.DEFAULT_MAX_ERROR_RATE,
+                        help="stop when more than this share of lines is rejected, files shorter than {} lines "
+                             "count as {} lines (default: {})".format(RejectedLines.MIN_CHECKED_LINES,
+                                                                      RejectedLines.MIN_CHECKED_LINES,
+                                                                      RejectedLines.DEFAULT_MAX_ERROR_RATE))
+    parser.add_argument("--checkpoint_interval", type=float, default=None,
+                        help="save a checkpoint to <output_file>{} this often in seconds, an interrupted "
+                             "conversion then resumes from it".format(ConversionCheckpoint.FILE_SUFFIX))
+    parser.add_argument("--stats", action="store_true",
+                        help="time each conversion stage and print a summary, needs a single worker")
+    parser.add_argument("--stats_json", default=None,
+                        help="time each conversion stage and write the statistics as json to this file")
     args = parser.parse_args()
 
-    input_file = args.input_file
-    output_file = args.output_file
-    bank = args.bank
-
-    return input_file, output_file, bank
+    return args
 
 
 def main():
-    input_file, output_file, bank = parse_command_line_arguments()
+    if len(sys.argv) > 1 and "batch" == sys.argv[1]:
+        sys.exit(batch_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and "serve" == sys.argv[1]:
+        sys.exit(serve_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and "ledger" == sys.argv[1]:
+        sys.exit(ledger_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and "query" == sys.argv[1]:
+        sys.exit(query_main(sys.argv[2:]))
+
+    args = parse_command_line_arguments()
+    input_file = args.input_file
+    output_file = args.output_file or args.output
+    bank = args.bank
+    if AUTO_BANK == bank:
+        bank = sniff_bank(input_file)
 
     output_file_name = OutputFileName()
     if None == output_file:
-        output_file = output_file_name.create_output_file_name(input_file)
-
-    print("Input file.: {}".format(input_file))
-    print("Output file: {}".format(output_file))
-    print("Bank.......: {}".format(bank))
-
-    file_reader = FileReader(input_file)
-    file_writer = FileWriter(output_file)
-    statement_line_converter = GeneralLineConverter(bank)
-
-    statement_converter = StatementConverter(statement_line_converter, file_reader, file_writer)
-    statement_converter.convert()
+        output_file = output_file_name.create_output_file_name(input_file, args.compress,
+                                                               OUTPUT_FORMATS[args.format].suffix)
+
+    # The csv goes to stdout when streaming, so everything else goes to stderr
+    info = sys.stderr if STDIO_FILE_NAME == output_file else sys.stdout
+    print("Input file.: {}".format(input_file), file=info)
+    print("Output file: {}".format(output_file), file=info)
+    print("Bank.......: {}".format(bank), file=info)
+
+    stats = None
+    if args.stats or None != args.stats_json:
+        stats = ConversionStats()
+
+    deduplicator = None
+    if None != args.dedup_index:
+        deduplicator = TransactionDeduplicator(args.dedup_index, args.dedup_capacity)
+
+    rejected_lines = None
+    if args.tolerant:
+        if None == args.rejected_file:
+            rejected_lines = RejectedLines.for_output_file(output_file, args.max_error_rate)
+        else:
+            rejected_lines = RejectedLines(args.rejected_file, args.max_error_rate)
+
+    convert_file(bank, input_file, output_file, batch_size=args.batch_size, buffer_size=args.buffer_size,
+                 workers=args.workers, use_mmap=args.mmap, stats=stats,
+                 incremental=args.incremental, deduplicator=deduplicator, result_cache=create_result_cache(args),
+                 compression=args.compress, rejected_lines=rejected_lines,
+                 checkpoint_interval=args.checkpoint_interval, output_format=args.format)
+
+    if None != deduplicator:
+        print("Duplicates.: {}".format(deduplicator.duplicates), file=info)
+        deduplicator.save()
+
+    if None != rejected_lines:
+        rejected_lines.close()
+        print("Rejected...: {}".format(rejected_lines.count), file=info)
+
+    if args.stats:
+        print(stats.summary(), file=info)
+    if None != args.stats_json:
+        stats.write_json(args.stats_json)
 
 
 if __name__ == '__main__':
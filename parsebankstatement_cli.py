@@ -0,0 +1,8 @@
+# coding=utf-8
+# Command line entry point with the same arguments as parsebankstatement.py.
+# Python compiles a script it runs on every start, but caches the bytecode of imported modules, so starting
+# through this file skips compiling parsebankstatement, which is most of the start time of a short conversion.
+from parsebankstatement import main
+
+if __name__ == '__main__':
+    main()
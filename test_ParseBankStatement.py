@@ -1,10 +1,56 @@
+import asyncio
+import bz2
+import errno
+import gzip
+import lzma
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
 import unittest
+from unittest import mock
 
+from benchmark_parsebankstatement import BANKS
+from benchmark_parsebankstatement import generate_lines
+
+from parsebankstatement import BANK_PROFILES
+from parsebankstatement import ConversionCheckpoint
+from parsebankstatement import ConversionJob
+from parsebankstatement import ConversionServer
+from parsebankstatement import ConversionStats
+from parsebankstatement import DateCache
 from parsebankstatement import ErrorInputLineEndsWithCsv
+from parsebankstatement import ErrorOutputFileAlreadyExists
+from parsebankstatement import ErrorTooManyRejectedLines
+from parsebankstatement import FileReader
+from parsebankstatement import FileWriter
+from parsebankstatement import FingerprintIndex
 from parsebankstatement import GeneralLineConverter
 from parsebankstatement import OutputFileName
+from parsebankstatement import RejectedLines
+from parsebankstatement import ResultCache
 from parsebankstatement import StatementConverter
+from parsebankstatement import Transaction
+from parsebankstatement import TransactionDeduplicator
+from parsebankstatement import amount_to_ore
+from parsebankstatement import ore_to_amount
+from parsebankstatement import transactions_to_csv
 from parsebankstatement import IcaLineConverter
+from parsebankstatement import Ledger
+from parsebankstatement import MmapFileReader
+from parsebankstatement import bank_profile
+from parsebankstatement import register_bank_profile
+from parsebankstatement import collect_conversion_jobs
+from parsebankstatement import convert_file
+from parsebankstatement import detect_bank
+from parsebankstatement import convert_jobs
+from parsebankstatement import load_into_ledger
+from parsebankstatement import load_pyarrow
+from parsebankstatement import split_file_into_chunks
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parsebankstatement.py")
 
 
 # The general idea is to read the bank statement line by line
@@ -43,6 +89,12 @@ class FileReaderSpy:
         cls.read_counter += 1
         return cls.lines.pop(0)
 
+    def read_lines(cls, count):
+        lines = []
+        while len(cls.lines) > 0 and len(lines) < count:
+            lines.append(cls.read_line())
+        return lines
+
     def line_count(cls):
         return len(cls.lines)
 
@@ -62,10 +114,16 @@ class FileWriterSpy:
 
     def __init__(cls):
         cls.lines = []
+        cls.batch_count = 0
 
     def write_line(cls, line):
         cls.lines.append(line)
 
+    def write_lines(cls, lines):
+        cls.batch_count += 1
+        for line in lines:
+            cls.lines.append(line)
+
     def write_count(cls):
         return len(cls.lines)
 
@@ -406,6 +464,57 @@ class TestStatementConverter(unittest.TestCase):
         self.assertEqual(len(lines) + 1, file_writer_spy.write_count())  # one extra to add header to csv file
         self.assertEqual(len(lines), statement_line_converter_spy.convert_count())
 
+    def test_statement_converter_instrumented(self):
+        # Setup
+        lines = []
+        lines.append("2017-02-12 	2017-04-01 	ITUNES.COM/BILL 	98 SEK 	-98 kr 	-552 kr")
+        lines.append("Transaktioner ovan har du ännu inte fått på ditt kontoutdrag.")
+        lines.append("2016-10-26 	2016-10-26 	INBETALNING - PG OCR 	0 	1 049,80 kr 	-2 676,43 kr")
+
+        file_reader_spy = FileReaderSpy()
+        file_reader_spy.add_lines(lines)
+        file_writer_spy = FileWriterSpy()
+        stats = ConversionStats()
+
+        statement_converter = StatementConverter(GeneralLineConverter("santander"), file_reader_spy,
+                                                 file_writer_spy, stats=stats)
+
+        # Execute
+        statement_converter.convert()
+
+        # Verify
+        self.assertEqual(3, stats.lines)
+        self.assertEqual(2, stats.converted_lines)
+        self.assertEqual(1, stats.skipped_lines)
+        self.assertEqual(0, stats.errors)
+        self.assertEqual(3, file_writer_spy.write_count())
+        self.assertEqual(set(ConversionStats.STAGES), set(stats.as_dict()["seconds"]))
+
+    def test_statement_converter_batched(self):
+        # Setup
+        lines = []
+        lines.append("2016-06-27 	2016-06-26 BLOMSTERLANDET I BORÅS, BORÅS 	-505,90 	390 841,26")
+        lines.append("2016-06-29 	Tåg varberg 	-284,00 	455 865,49")
+        lines.append("2016-07-05 	2016-07-04 INET RINGÖN, GÖTEBORG 	-1 174,00 	434 355,07")
+
+        statement_line_converter_spy = SkandiaLineConverterSpy()
+        file_reader_spy = FileReaderSpy()
+        file_reader_spy.add_lines(lines)
+
+        file_writer_spy = FileWriterSpy()
+
+        statement_converter = StatementConverter(statement_line_converter_spy, file_reader_spy, file_writer_spy,
+                                                 batch_size=2)
+
+        # Execute
+        statement_converter.convert()
+
+        # Verify
+        self.assertEqual(file_reader_spy.line_count(), 0)
+        self.assertEqual(2, file_writer_spy.batch_count)
+        self.assertEqual(len(lines) + 1, file_writer_spy.write_count())  # one extra to add header to csv file
+        self.assertEqual(lines, file_writer_spy.lines[1:])
+
 
 class TestIcaLineConvert(unittest.TestCase):
 
@@ -609,6 +718,1377 @@ class TestIca2LineConvert(unittest.TestCase):
         # Verify
         self.assertEqual(expected_inflow, result)
 
+class TestConvertLine(unittest.TestCase):
+
+    def test_convert_line_santander(self):
+        # Setup
+        line_converter = GeneralLineConverter("santander")
+        input_line = "2016-10-18 	2016-12-01 	CLAS OHLSON 	0 	-710,40 kr 	-3 617,43 kr"
+        expected_line = "18/10/2016,CLAS OHLSON,,,710.40,\n"
+
+        # Execute
+        result = line_converter.convert_line(input_line)
+
+        # Verify
+        self.assertEqual(expected_line, result)
+
+    def test_convert_line_ica2_semicolon(self):
+        # Setup
+        line_converter = IcaLineConverter("ica2")
+        input_line = "2021-09-13;Från Skandia;Insättning;Övrigt;5 000,00 kr;5 179,64 kr"
+        expected_line = "13/09/2021,Från Skandia,,,,5000.00\n"
+
+        # Execute
+        result = line_converter.convert_line(input_line)
+
+        # Verify
+        self.assertEqual(expected_line, result)
+
+    def test_tokenize_line_reuses_field_record(self):
+        # Setup
+        line_converter = GeneralLineConverter("skandia")
+
+        # Execute
+        first = line_converter.tokenize_line("2016-06-28 	Jacob 	37 299,00 	457 794,26")
+        second = line_converter.tokenize_line("2016-06-29 	Tåg varberg 	-284,00 	455 865,49")
+
+        # Verify
+        self.assertIs(first, second)
+        self.assertEqual("2016-06-29 ", second.items[0])
+
+
+class TestTransactionRecord(unittest.TestCase):
+
+    def test_convert_record(self):
+        # Setup
+        line_converter = GeneralLineConverter("skandia")
+        input_line = "2016-07-11 	2016-07-10 CAFE LUNDBY, GOTEBORG 	-20,00 	414 890,89"
+        expected_transaction = Transaction("10/07/2016", "CAFE LUNDBY. GOTEBORG", "20.00", "", -2000)
+
+        # Execute
+        result = line_converter.convert_record(input_line)
+
+        # Verify
+        self.assertEqual(expected_transaction, result)
+
+    def test_convert_record_ignored_line(self):
+        # Setup
+        line_converter = GeneralLineConverter("santander")
+        input_line = "Transaktioner ovan har du ännu inte fått på ditt kontoutdrag."
+
+        # Execute
+        result = line_converter.convert_record(input_line)
+
+        # Verify
+        self.assertIsNone(result)
+
+    def test_transactions_to_csv_matches_convert_line(self):
+        # Setup
+        line_converter = GeneralLineConverter("santander")
+        lines = ["2017-02-12 	2017-04-01 	ITUNES.COM/BILL 	98 SEK 	-98 kr 	-552 kr",
+                 "Transaktioner ovan har du ännu inte fått på ditt kontoutdrag.",
+                 "2016-10-26 	2016-10-26 	INBETALNING - PG OCR 	0 	1 049,80 kr 	-2 676,43 kr"]
+        expected_csv = "".join([line_converter.convert_line(line) for line in lines])
+
+        # Execute
+        result = transactions_to_csv(line_converter.convert_records(lines))
+
+        # Verify
+        self.assertEqual(expected_csv, result)
+
+
+class TestBankProfiles(unittest.TestCase):
+
+    def test_register_bank_profile(self):
+        # Setup
+        register_bank_profile("testbank", bank_profile(transaction_position=2, payee_position=1, delimiter='|'))
+        input_line = "2020-01-31|Kiosken|-12,50 kr|100,00 kr"
+        expected_line = "31/01/2020,Kiosken,,,12.50,\n"
+
+        # Execute
+        try:
+            result = GeneralLineConverter("testbank").convert_line(input_line)
+        finally:
+            del BANK_PROFILES["testbank"]
+
+        # Verify
+        self.assertEqual(expected_line, result)
+
+    def test_invalid_bank_raises(self):
+        # Execute / Verify
+        with self.assertRaises(Exception):
+            GeneralLineConverter("nobank")
+        with self.assertRaises(Exception):
+            IcaLineConverter("santander")
+
+    def test_ica_alias_uses_semicolon_profile(self):
+        # Setup
+        input_line = "2021-11-03;Cafe Lundby                   ;Korttransaktion;Övrigt;-35,00 kr;4 974,64 kr"
+
+        # Execute
+        result = IcaLineConverter("ica2").convert_line(input_line)
+
+        # Verify
+        self.assertEqual(GeneralLineConverter("ica2_semicolon").convert_line(input_line), result)
+        self.assertEqual("03/11/2021,Cafe Lundby,,,35.00,\n", result)
+
+    def test_ignore_line_is_only_checked_by_profiles_with_one(self):
+        # Setup
+        input_line = "Transaktioner ovan har du ännu inte fått på ditt kontoutdrag."
+
+        # Execute / Verify
+        self.assertEqual("", GeneralLineConverter("santander").convert_line(input_line))
+        self.assertIsNone(GeneralLineConverter("santander").convert_record(input_line))
+        with self.assertRaises(Exception):
+            GeneralLineConverter("skandia").convert_line(input_line)
+
+
+class TestBankDetection(unittest.TestCase):
+
+    def test_detects_every_bank(self):
+        for bank in BANKS:
+            # Setup
+            lines = generate_lines(bank, 20)
+
+            # Execute
+            result = detect_bank(lines)
+
+            # Verify
+            self.assertEqual(bank, result)
+
+    def test_detects_exported_lines(self):
+        # Setup
+        santander_lines = ["2017-03-16 \t2017-05-01 \tHERTZ SWEDEN FRANCHI \t3 412,58 SEK \t-3 412,58 kr "
+                           "\t-3 704,58 kr\n",
+                           "Transaktioner ovan har du ännu inte fått på ditt kontoutdrag.\n"]
+        skandia_lines = ["2016-07-11 \t2016-07-10 CAFE LUNDBY, GOTEBORG \t-20,00 \t414 890,89\n",
+                         "2016-06-28 \tJacob \t37 299,00 \t457 794,26\n"]
+
+        # Execute / Verify
+        self.assertEqual("santander", detect_bank(santander_lines))
+        self.assertEqual("skandia", detect_bank(skandia_lines))
+
+    def test_detects_semicolon_ica2(self):
+        # Setup
+        lines = ["2021-11-03;Cafe Lundby                   ;Korttransaktion;Övrigt;-35,00 kr;4 974,64 kr\n",
+                 "2021-09-13;Från Skandia;Insättning;Övrigt;5 000,00 kr;5 179,64 kr\n"]
+
+        # Execute
+        result = detect_bank(lines)
+
+        # Verify
+        self.assertEqual("ica2_semicolon", result)
+
+    def test_unknown_format_raises(self):
+        # Execute / Verify
+        with self.assertRaises(Exception):
+            detect_bank(["Datum;Text;Belopp\n", "\n"])
+
+    def test_convert_file_with_auto_bank(self):
+        # Setup
+        directory = tempfile.mkdtemp()
+        input_file = os.path.join(directory, "statement.txt")
+        with open(input_file, 'w') as f_input:
+            f_input.writelines(generate_lines("ica2", 3))
+        line_converter = GeneralLineConverter("ica2")
+        expected_output = "".join(line_converter.convert_line(line) for line in generate_lines("ica2", 3))
+
+        # Execute
+        try:
+            output_file = convert_file("auto", input_file)
+            with open(output_file) as f_output:
+                result = f_output.read()
+        finally:
+            shutil.rmtree(directory)
+
+        # Verify
+        self.assertEqual("Date,Payee,Category,Memo,Outflow,Inflow\n" + expected_output, result)
+
+
+class TestAmountInOre(unittest.TestCase):
+
+    def test_amount_to_ore(self):
+        self.assertEqual(-341258, amount_to_ore("-3412.58"))
+        self.assertEqual(9900, amount_to_ore("99"))
+        self.assertEqual(104980, amount_to_ore("1049.80"))
+        self.assertEqual(-50, amount_to_ore("-0.5"))
+        self.assertEqual(3729900, amount_to_ore("+37299.00"))
+
+    def test_invalid_amount_raises(self):
+        for amount in ["", "-", "+", "+-1", "12.345", "1.2.3", "12kr"]:
+            with self.assertRaises(Exception):
+                amount_to_ore(amount)
+
+    def test_ore_to_amount(self):
+        self.assertEqual("-3412.58", ore_to_amount(-341258))
+        self.assertEqual("99.00", ore_to_amount(9900))
+        self.assertEqual("0.05", ore_to_amount(5))
+
+    def test_record_amounts_sum(self):
+        # Setup
+        line_converter = GeneralLineConverter("ica")
+        lines = ["2018-06-04 	LUNDBYBADET GOTEBORG 	Reserverat Belopp 	Övrigt 	-60,00 kr 	",
+                 "2018-04-05 	Skandiabanke 	Insättning	Övrigt	3 000,00 kr 	3 000,00 kr "]
+
+        # Execute
+        result = sum(transaction.amount for transaction in line_converter.convert_records(lines))
+
+        # Verify
+        self.assertEqual(294000, result)
+
+    def test_record_with_plus_sign_matches_csv(self):
+        # Setup
+        line_converter = GeneralLineConverter("skandia")
+        line = "2016-06-28 	Jacob 	+37 299,00 	457 794,26"
+
+        # Execute
+        transaction = line_converter.convert_record(line)
+
+        # Verify
+        self.assertEqual(3729900, transaction.amount)
+        self.assertEqual(line_converter.convert_line(line), transactions_to_csv([transaction]))
+
+
+class TestDateCache(unittest.TestCase):
+
+    def test_counts_hits_and_misses(self):
+        # Setup
+        line_converter = GeneralLineConverter("skandia")
+        line_converter.date_cache = DateCache()
+        input_line = "2016-06-28 	Jacob 	37 299,00 	457 794,26"
+
+        # Execute
+        first = line_converter.parse_date(input_line)
+        second = line_converter.parse_date(input_line)
+
+        # Verify
+        self.assertEqual("28/06/2016", first)
+        self.assertEqual(first, second)
+        self.assertEqual(1, line_converter.date_cache.hits)
+        self.assertEqual(1, line_converter.date_cache.misses)
+
+    def test_evicts_least_recently_used(self):
+        # Setup
+        date_cache = DateCache(max_size=2)
+        date_cache.put("2016-06-28", "%Y-%m-%d", "28/06/2016")
+        date_cache.put("2016-06-29", "%Y-%m-%d", "29/06/2016")
+
+        # Execute
+        date_cache.get("2016-06-28", "%Y-%m-%d")
+        date_cache.put("2016-06-30", "%Y-%m-%d", "30/06/2016")
+
+        # Verify
+        self.assertEqual("28/06/2016", date_cache.get("2016-06-28", "%Y-%m-%d"))
+        self.assertIsNone(date_cache.get("2016-06-29", "%Y-%m-%d"))
+        self.assertEqual(2, date_cache.info()["size"])
+
+
+class TestIca2MonthStringDate(unittest.TestCase):
+
+    def test_parse_date_swedish_month(self):
+        # Setup
+        parse_bank_statement = GeneralLineConverter("ica2")
+        input_line = "13 maj 2021	Från Skandia	Insättning	Övrigt	5 000,00 kr	5 179,64 kr"
+        expected_date = "13/05/2021"
+
+        # Execute
+        result = parse_bank_statement.parse_date(input_line)
+
+        # Verify
+        self.assertEqual(expected_date, result)
+
+    def test_parse_date_english_month_upper_case(self):
+        # Setup
+        parse_bank_statement = GeneralLineConverter("ica2")
+        input_line = "03 OCT 2021	Cafe Lundby	Korttransaktion	Övrigt	-35,00 kr	4 974,64 kr"
+        expected_date = "03/10/2021"
+
+        # Execute
+        result = parse_bank_statement.parse_date(input_line)
+
+        # Verify
+        self.assertEqual(expected_date, result)
+
+    def test_invalid_month_string_raises(self):
+        # Setup
+        parse_bank_statement = GeneralLineConverter("ica2")
+
+        # Execute / Verify
+        with self.assertRaises(Exception):
+            parse_bank_statement._convert_month_string_to_month_number("xyz")
+
+    def test_day_out_of_range_for_month_raises(self):
+        # Setup
+        parse_bank_statement = GeneralLineConverter("ica2")
+
+        # Execute / Verify
+        for date in ["30 feb 2021", "29 feb 2021", "31 apr 2021", "31 nov 2021", "29 feb 1900", "00 jan 2021"]:
+            with self.assertRaises(Exception, msg=date):
+                parse_bank_statement._convert_date_with_month_string(date)
+
+    def test_last_day_of_month(self):
+        # Setup
+        parse_bank_statement = GeneralLineConverter("ica2")
+
+        # Execute / Verify
+        self.assertEqual("29/02/2020", parse_bank_statement._convert_date_with_month_string("29 feb 2020"))
+        self.assertEqual("29/02/2000", parse_bank_statement._convert_date_with_month_string("29 feb 2000"))
+        self.assertEqual("30/04/2021", parse_bank_statement._convert_date_with_month_string("30 apr 2021"))
+        self.assertEqual("31/12/2021", parse_bank_statement._convert_date_with_month_string("31 dec 2021"))
+
+
+class TestBatchConversion(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.directory, "statement.txt")
+        with open(self.input_file, 'w') as f_input:
+            f_input.write("2016-06-28 	Jacob 	37 299,00 	457 794,26\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_collect_jobs_from_directory(self):
+        # Execute
+        jobs = collect_conversion_jobs("skandia", [self.directory])
+
+        # Verify
+        self.assertEqual([ConversionJob("skandia", self.input_file, None)], jobs)
+
+    def test_convert_jobs_reports_success_and_failure(self):
+        # Setup
+        jobs = [ConversionJob("skandia", self.input_file, None),
+                ConversionJob("skandia", self.input_file, None)]
+        expected_output_file = os.path.join(self.directory, "statement.csv")
+
+        # Execute
+        results = convert_jobs(jobs, workers=1)
+
+        # Verify
+        self.assertTrue(results[0].success)
+        self.assertEqual(expected_output_file, results[0].output_file)
+        self.assertFalse(results[1].success)
+        self.assertEqual("Output file name already exists", results[1].message)
+        with open(expected_output_file) as f_output:
+            self.assertEqual("Date,Payee,Category,Memo,Outflow,Inflow\n28/06/2016,Jacob,,,,37299.00\n",
+                             f_output.read())
+
+
+    def test_shared_deduplicator_drops_transactions_of_earlier_files(self):
+        # Setup
+        later_input_file = os.path.join(self.directory, "statement_later.txt")
+        with open(later_input_file, 'w') as f_input:
+            f_input.writelines(["2016-06-28 	Jacob 	37 299,00 	457 794,26\n",
+                                "2016-06-30 	Kiosk 	-20,00 	455 845,49\n"])
+        jobs = [ConversionJob("skandia", self.input_file, None), ConversionJob("skandia", later_input_file, None)]
+        deduplicator = TransactionDeduplicator(capacity=100)
+
+        # Execute
+        results = convert_jobs(jobs, workers=4, deduplicator=deduplicator)
+
+        # Verify
+        self.assertTrue(all(result.success for result in results))
+        self.assertEqual(1, deduplicator.duplicates)
+        with open(results[1].output_file) as f_output:
+            self.assertEqual("Date,Payee,Category,Memo,Outflow,Inflow\n30/06/2016,Kiosk,,,20.00,\n",
+                             f_output.read())
+
+class TestParallelChunkConversion(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.directory, "statement.txt")
+        with open(self.input_file, 'w') as f_input:
+            for day in range(1, 29):
+                f_input.write("2017-02-{:02d} 	2017-04-01 	ITUNES.COM/BILL 	98 SEK 	-{},50 kr 	-552 kr\n".format(day, day))
+                f_input.write("Transaktioner ovan har du ännu inte fått på ditt kontoutdrag.\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert(self, output_name, workers):
+        output_file = os.path.join(self.directory, output_name)
+        statement_converter = StatementConverter(GeneralLineConverter("santander"), FileReader(self.input_file),
+                                                 FileWriter(output_file), workers=workers)
+        statement_converter.MIN_CHUNK_SIZE = 1
+        statement_converter.convert()
+        del statement_converter
+        with open(output_file) as f_output:
+            return f_output.read()
+
+    def test_statistics_in_several_workers_raise(self):
+        # Setup
+        output_file = os.path.join(self.directory, "statement.csv")
+
+        # Execute / Verify
+        with self.assertRaises(Exception):
+            convert_file("santander", self.input_file, output_file, workers=2, stats=ConversionStats())
+        self.assertFalse(os.path.isfile(output_file))
+
+    def test_chunks_end_on_line_boundaries(self):
+        # Execute
+        chunks = split_file_into_chunks(self.input_file, 5)
+
+        # Verify
+        with open(self.input_file, 'rb') as f_input:
+            data = f_input.read()
+        self.assertEqual(0, chunks[0][0])
+        self.assertEqual(len(data), chunks[-1][1])
+        for start, end in chunks:
+            self.assertEqual(b"\n", data[end - 1:end])
+
+    def test_parallel_output_matches_sequential(self):
+        # Execute
+        sequential = self.convert("sequential.csv", 1)
+        parallel = self.convert("parallel.csv", 3)
+
+        # Verify
+        self.assertEqual(sequential, parallel)
+        self.assertEqual(29, len(parallel.splitlines()))
+
+
+class TestMmapFileReader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.directory, "statement.txt")
+        with open(self.input_file, 'wb') as f_input:
+            f_input.write("2016-06-28 	Jacob\r\n2016-06-29 	Tåg varberg\n\n2016-07-05 	INET RINGÖN".encode("utf-8"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reads_same_lines_as_file_reader(self):
+        # Setup
+        expected_lines = list(FileReader(self.input_file))
+
+        # Execute
+        result = list(MmapFileReader(self.input_file, encoding="utf-8"))
+
+        # Verify
+        self.assertEqual(expected_lines, result)
+
+    def test_read_lines_in_batches(self):
+        # Setup
+        file_reader = MmapFileReader(self.input_file, encoding="utf-8")
+
+        # Execute
+        first = file_reader.read_lines(3)
+        second = file_reader.read_lines(3)
+        third = file_reader.read_lines(3)
+
+        # Verify
+        self.assertEqual(["2016-06-28 	Jacob\n", "2016-06-29 	Tåg varberg\n", "\n"], first)
+        self.assertEqual(["2016-07-05 	INET RINGÖN"], second)
+        self.assertEqual([], third)
+
+    def test_empty_file(self):
+        # Setup
+        empty_file = os.path.join(self.directory, "empty.txt")
+        open(empty_file, 'w').close()
+
+        # Execute
+        result = list(MmapFileReader(empty_file))
+
+        # Verify
+        self.assertEqual([], result)
+
+
+class TestBenchmarkStatementGenerator(unittest.TestCase):
+
+    def test_generated_lines_convert_for_every_bank(self):
+        for bank in BANKS:
+            # Setup
+            line_converter = GeneralLineConverter(bank)
+            lines = generate_lines(bank, 50)
+
+            # Execute
+            converted_lines = [line_converter.convert_line(line) for line in lines]
+
+            # Verify
+            for converted_line in converted_lines:
+                self.assertEqual(6, len(converted_line.split(',')), bank + ": " + converted_line)
+
+
+class TestCompressedFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.lines = ["2016-06-28 \tJacob \t37 299,00 \t457 794,26\n",
+                      "2016-06-29 \tTåg varberg \t-284,00 \t455 865,49\n"]
+        self.expected_output = ("Date,Payee,Category,Memo,Outflow,Inflow\n"
+                                "28/06/2016,Jacob,,,,37299.00\n"
+                                "29/06/2016,Tåg varberg,,,284.00,\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compressed_input_is_detected(self):
+        for suffix, open_compressed in [(".gz", gzip.open), (".xz", lzma.open), (".bz2", bz2.open)]:
+            # Setup
+            input_file = os.path.join(self.directory, "statement.txt" + suffix)
+            with open_compressed(input_file, 'wt') as f_input:
+                f_input.writelines(self.lines)
+
+            # Execute
+            output_file = convert_file("skandia", input_file, use_mmap=True, workers=2)
+
+            # Verify
+            self.assertEqual(os.path.join(self.directory, "statement.csv"), output_file)
+            with open(output_file) as f_output:
+                self.assertEqual(self.expected_output, f_output.read())
+            os.remove(output_file)
+
+    def test_unbuffered_reader_detects_compression(self):
+        for suffix, open_compressed in [("", open), (".gz", gzip.open)]:
+            # Setup
+            input_file = os.path.join(self.directory, "statement.txt" + suffix)
+            with open_compressed(input_file, 'wt') as f_input:
+                f_input.writelines(self.lines)
+
+            # Execute
+            file_reader = FileReader(input_file, buffer_size=0)
+
+            # Verify
+            self.assertEqual(self.lines, file_reader.read_lines(10))
+
+    def test_cli_rejects_buffer_size_zero(self):
+        # Setup
+        input_file = os.path.join(self.directory, "statement.txt")
+        with open(input_file, 'w') as f_input:
+            f_input.writelines(self.lines)
+
+        # Execute
+        completed = subprocess.run([sys.executable, SCRIPT, "skandia", input_file, "--buffer_size", "0"],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+        # Verify
+        self.assertEqual(2, completed.returncode)
+        self.assertIn("--buffer_size", completed.stderr)
+
+    def test_output_compression_is_selectable(self):
+        # Setup
+        input_file = os.path.join(self.directory, "statement.txt")
+        with open(input_file, 'w') as f_input:
+            f_input.writelines(self.lines)
+
+        # Execute
+        output_file = convert_file("skandia", input_file, compression="xz")
+
+        # Verify
+        self.assertEqual(os.path.join(self.directory, "statement.csv.xz"), output_file)
+        with lzma.open(output_file, 'rt') as f_output:
+            self.assertEqual(self.expected_output, f_output.read())
+
+    def test_output_compression_from_file_name(self):
+        # Setup
+        output_file = os.path.join(self.directory, "statement.csv.gz")
+        file_writer = FileWriter(output_file)
+
+        # Execute
+        file_writer.write_lines(self.lines)
+        file_writer.close()
+
+        # Verify
+        with gzip.open(output_file, 'rt') as f_output:
+            self.assertEqual("".join(self.lines), f_output.read())
+
+
+class TestTolerantConversion(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.directory, "statement.txt")
+        self.output_file = os.path.join(self.directory, "statement.csv")
+        self.rejected_file = os.path.join(self.directory, "statement.csv.rejected")
+        with open(self.input_file, 'w') as f_input:
+            f_input.writelines(["2016-06-28 \tJacob \t37 299,00 \t457 794,26\n",
+                                "2016-06-29 \tTåg varberg\n",
+                                "2016-06-30 \t2016-06-31 \t2016-07-01 \t-20,00 \t455 845,49\n",
+                                "2016-06-30 \tKiosk \t-20,00 \t455 845,49\n"])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rejected_lines_go_to_sidecar(self):
+        for batch_size in [0, 2, StatementConverter.DEFAULT_BATCH_SIZE]:
+            # Setup
+            rejected_lines = RejectedLines.for_output_file(self.output_file, max_error_rate=0.5)
+
+            # Execute
+            convert_file("skandia", self.input_file, batch_size=batch_size, rejected_lines=rejected_lines)
+            rejected_lines.close()
+
+            # Verify
+            with open(self.output_file) as f_output:
+                self.assertEqual("Date,Payee,Category,Memo,Outflow,Inflow\n"
+                                 "28/06/2016,Jacob,,,,37299.00\n"
+                                 "30/06/2016,Kiosk,,,20.00,\n", f_output.read())
+            with open(self.rejected_file) as f_rejected:
+                rejected = [line.split('\t', 2) for line in f_rejected]
+            self.assertEqual(["2", "3"], [line_number for line_number, _, _ in rejected])
+            self.assertEqual("list index out of range", rejected[0][1])
+            self.assertEqual("2016-06-29 \tTåg varberg\n", rejected[0][2])
+            self.assertEqual(2, rejected_lines.count)
+            os.remove(self.output_file)
+
+    def test_stops_above_max_error_rate(self):
+        # Setup
+        rejected_lines = RejectedLines(self.rejected_file, max_error_rate=0.25)
+        rejected_lines.MIN_CHECKED_LINES = 4
+
+        # Execute / Verify
+        with self.assertRaises(ErrorTooManyRejectedLines):
+            convert_file("skandia", self.input_file, rejected_lines=rejected_lines)
+
+    def test_small_file_with_one_bad_line(self):
+        # Setup
+        input_file = os.path.join(self.directory, "small.txt")
+        with open(input_file, 'w') as f_input:
+            f_input.writelines(["2016-06-28 \tJacob \t37 299,00 \t457 794,26\n"] * 50)
+            f_input.write("2016-06-29 \tTåg varberg\n")
+        rejected_lines = RejectedLines(self.rejected_file)
+
+        # Execute
+        output_file = convert_file("skandia", input_file, rejected_lines=rejected_lines)
+        rejected_lines.close()
+
+        # Verify
+        self.assertEqual(1, rejected_lines.count)
+        with open(output_file) as f_output:
+            self.assertEqual(51, len(f_output.readlines()))
+
+    def test_small_file_with_many_bad_lines_stops(self):
+        # Setup
+        input_file = os.path.join(self.directory, "small.txt")
+        with open(input_file, 'w') as f_input:
+            f_input.writelines(["2016-06-29 \tTåg varberg\n"] * 11)
+        rejected_lines = RejectedLines(self.rejected_file)
+
+        # Execute / Verify
+        with self.assertRaises(ErrorTooManyRejectedLines):
+            convert_file("skandia", input_file, rejected_lines=rejected_lines)
+
+    def test_sidecar_only_created_for_rejected_lines(self):
+        # Setup
+        input_file = os.path.join(self.directory, "valid.txt")
+        with open(input_file, 'w') as f_input:
+            f_input.write("2016-06-28 \tJacob \t37 299,00 \t457 794,26\n")
+        rejected_lines = RejectedLines(self.rejected_file)
+
+        # Execute
+        convert_file("skandia", input_file, rejected_lines=rejected_lines, stats=ConversionStats())
+        rejected_lines.close()
+
+        # Verify
+        self.assertEqual(0, rejected_lines.count)
+        self.assertFalse(os.path.exists(self.rejected_file))
+
+    def test_clean_run_removes_earlier_sidecar(self):
+        # Setup
+        input_file = os.path.join(self.directory, "valid.txt")
+        with open(input_file, 'w') as f_input:
+            f_input.write("2016-06-28 \tJacob \t37 299,00 \t457 794,26\n")
+        with open(self.rejected_file, 'w') as f_rejected:
+            f_rejected.write("2\tlist index out of range\t2016-06-29 \tTåg varberg\n")
+        rejected_lines = RejectedLines(self.rejected_file)
+
+        # Execute
+        convert_file("skandia", input_file, self.output_file, rejected_lines=rejected_lines)
+        rejected_lines.close()
+
+        # Verify
+        self.assertEqual(0, rejected_lines.count)
+        self.assertFalse(os.path.exists(self.rejected_file))
+
+
+class TestAtomicOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.directory, "statement.txt")
+        self.output_file = os.path.join(self.directory, "statement.csv")
+        self.good_lines = ["2016-06-28 \tJacob \t37 299,00 \t457 794,26\n",
+                           "2016-06-29 \tTåg varberg \t-284,00 \t455 865,49\n",
+                           "2016-06-30 \tKiosk \t-20,00 \t455 845,49\n"]
+        self.expected_output = ("Date,Payee,Category,Memo,Outflow,Inflow\n"
+                                "28/06/2016,Jacob,,,,37299.00\n"
+                                "29/06/2016,Tåg varberg,,,284.00,\n"
+                                "30/06/2016,Kiosk,,,20.00,\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_input(self, lines):
+        with open(self.input_file, 'w') as f_input:
+            f_input.writelines(lines)
+
+    def read_output(self):
+        with open(self.output_file) as f_output:
+            return f_output.read()
+
+    def test_output_only_appears_on_commit(self):
+        # Setup
+        file_writer = FileWriter(self.output_file, atomic=True)
+        file_writer.write_line("Date\n")
+
+        # Execute
+        exists_before_commit = os.path.exists(self.output_file)
+        file_writer.commit()
+
+        # Verify
+        self.assertFalse(exists_before_commit)
+        self.assertEqual("Date\n", self.read_output())
+        self.assertFalse(os.path.exists(self.output_file + FileWriter.TEMPORARY_SUFFIX))
+
+    def test_failed_conversion_leaves_no_output(self):
+        # Setup
+        self.write_input(self.good_lines + ["2016-06-31 \tBroken\n"])
+
+        # Execute
+        with self.assertRaises(Exception):
+            convert_file("skandia", self.input_file, batch_size=1)
+        self.write_input(self.good_lines)
+        convert_file("skandia", self.input_file)
+
+        # Verify
+        self.assertEqual(self.expected_output, self.read_output())
+
+    def test_resumes_from_checkpoint(self):
+        # Setup
+        self.write_input(self.good_lines + ["2016-06-31 \tBroken\n"])
+        with self.assertRaises(Exception):
+            convert_file("skandia", self.input_file, batch_size=1, checkpoint_interval=0)
+        checkpoint = ConversionCheckpoint.for_output_file(self.output_file, self.input_file, "skandia")
+        partial_file = self.output_file + FileWriter.TEMPORARY_SUFFIX
+        with open(partial_file) as f_partial:
+            partial_output = f_partial.read()
+        with open(partial_file, 'w') as f_partial:
+            f_partial.write(partial_output.replace("Jacob", "JACOB"))  # Only kept when the run resumes
+
+        # Execute
+        convert_file("skandia", self.input_file, batch_size=1, checkpoint_interval=0,
+                     rejected_lines=RejectedLines(os.path.join(self.directory, "rejected"), max_error_rate=1.0))
+
+        # Verify
+        self.assertEqual(sum(len(line.encode()) for line in self.good_lines), checkpoint.input_offset)
+        self.assertEqual(self.expected_output.replace("Jacob", "JACOB"), self.read_output())
+        self.assertFalse(os.path.exists(checkpoint.file_name))
+        with open(os.path.join(self.directory, "rejected")) as f_rejected:
+            self.assertEqual("4", f_rejected.read().split('\t')[0])  # Numbered from the start of the input
+
+    def test_resumes_compressed_input_with_line_numbers(self):
+        # Setup
+        input_file = self.input_file + ".gz"
+        with gzip.open(input_file, 'wt') as f_input:
+            f_input.writelines(self.good_lines * 100 + ["2016-06-31 \tBroken\n"])
+        with self.assertRaises(Exception):
+            convert_file("skandia", input_file, self.output_file, batch_size=1, checkpoint_interval=0)
+        rejected_file = os.path.join(self.directory, "rejected")
+
+        # Execute
+        convert_file("skandia", input_file, self.output_file, batch_size=1, checkpoint_interval=0,
+                     rejected_lines=RejectedLines(rejected_file, max_error_rate=1.0))
+
+        # Verify
+        with open(rejected_file) as f_rejected:
+            self.assertEqual("301", f_rejected.read().split('\t')[0])
+
+    def test_resumes_rejected_lines_from_checkpoint(self):
+        # Setup
+        bad_line = "2016-06-31 \tBroken\n"
+        self.write_input(self.good_lines[:2] + [bad_line, self.good_lines[2], bad_line, bad_line])
+        rejected_file = os.path.join(self.directory, "rejected")
+        rejected_lines = RejectedLines(rejected_file, max_error_rate=0.34)
+        rejected_lines.MIN_CHECKED_LINES = 1
+        with self.assertRaises(ErrorTooManyRejectedLines):
+            convert_file("skandia", self.input_file, batch_size=1, checkpoint_interval=0, rejected_lines=rejected_lines)
+        rejected_lines.close()
+
+        # Execute
+        rejected_lines = RejectedLines(rejected_file, max_error_rate=1.0)
+        convert_file("skandia", self.input_file, batch_size=1, checkpoint_interval=0, rejected_lines=rejected_lines)
+        rejected_lines.close()
+
+        # Verify
+        self.assertEqual(self.expected_output, self.read_output())
+        with open(rejected_file) as f_rejected:
+            self.assertEqual(["3", "5", "6"], [line.split('\t')[0] for line in f_rejected])
+        self.assertEqual(3, rejected_lines.count)
+
+    def test_checkpoints_with_deduplication_raise(self):
+        # Setup
+        self.write_input(self.good_lines)
+
+        # Execute / Verify
+        with self.assertRaises(Exception):
+            convert_file("skandia", self.input_file, checkpoint_interval=0, deduplicator=TransactionDeduplicator())
+
+
+class TestOutputFormats(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.directory, "statement.txt")
+        with open(self.input_file, 'w') as f_input:
+            f_input.writelines(["2016-06-28 \tJacob \t37 299,00 \t457 794,26\n",
+                                "2016-06-29 \tTåg \"varberg\" \t-284,00 \t455 865,49\n"])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_json_lines(self):
+        # Execute
+        output_file = convert_file("skandia", self.input_file, output_format="jsonl")
+
+        # Verify
+        self.assertEqual(os.path.join(self.directory, "statement.jsonl"), output_file)
+        with open(output_file) as f_output:
+            result = f_output.read()
+        self.assertEqual('{"date": "2016-06-28", "payee": "Jacob", "amount": 3729900}\n'
+                         '{"date": "2016-06-29", "payee": "Tåg \\"varberg\\"", "amount": -28400}\n', result)
+
+    def test_sqlite_with_rejected_line(self):
+        # Setup
+        with open(self.input_file, 'a') as f_input:
+            f_input.write("2016-06-30 \tBroken\n")
+        rejected_lines = RejectedLines(os.path.join(self.directory, "rejected"), max_error_rate=0.5)
+
+        # Execute
+        output_file = convert_file("skandia", self.input_file, batch_size=2, output_format="sqlite",
+                                   rejected_lines=rejected_lines)
+        rejected_lines.close()
+
+        # Verify
+        connection = sqlite3.connect(output_file)
+        try:
+            rows = connection.execute("SELECT date, payee, amount FROM transactions").fetchall()
+        finally:
+            connection.close()
+        self.assertEqual([("2016-06-28", "Jacob", 3729900), ("2016-06-29", 'Tåg "varberg"', -28400)], rows)
+        self.assertEqual(1, rejected_lines.count)
+        self.assertFalse(os.path.exists(output_file + FileWriter.TEMPORARY_SUFFIX))
+
+    @unittest.skipIf(load_pyarrow() is None, "pyarrow is not installed")
+    def test_parquet(self):
+        # Setup
+        import datetime
+        import pyarrow.parquet
+
+        # Execute
+        output_file = convert_file("skandia", self.input_file, output_format="parquet")
+
+        # Verify
+        table = pyarrow.parquet.read_table(output_file)
+        self.assertEqual([{"date": datetime.date(2016, 6, 28), "payee": "Jacob", "amount": 3729900},
+                          {"date": datetime.date(2016, 6, 29), "payee": 'Tåg "varberg"', "amount": -28400}],
+                         table.to_pylist())
+
+    def test_csv_only_options_raise(self):
+        # Execute / Verify
+        with self.assertRaises(Exception):
+            convert_file("skandia", self.input_file, output_format="jsonl", incremental=True)
+
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ledger = Ledger(os.path.join(self.directory, "ledger.sqlite"))
+        self.skandia_file = os.path.join(self.directory, "skandia.txt")
+        self.santander_file = os.path.join(self.directory, "santander.txt")
+        self.write_input(self.skandia_file, ["2016-06-28 \tJacob \t37 299,00 \t457 794,26\n",
+                                             "2016-06-29 \tTåg varberg \t-284,00 \t455 865,49\n",
+                                             "2016-07-01 \tTÅG VARBERG \t-84,00 \t455 781,49\n"])
+        self.write_input(self.santander_file, ["2016-06-30 \t2016-06-30 \tKiosk \t0 \t-20,00 kr \t1 kr\n"])
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.directory)
+
+    def write_input(self, file_name, lines):
+        with open(file_name, 'w') as f_input:
+            f_input.writelines(lines)
+
+    def test_queries(self):
+        # Setup
+        load_into_ledger(self.ledger, "skandia", self.skandia_file)
+        load_into_ledger(self.ledger, "auto", self.santander_file)
+
+        # Execute
+        june = self.ledger.transactions("2016-06-01", "2016-06-30")
+        payee = self.ledger.transactions(payee="tåg%")
+        santander = self.ledger.transactions(bank="santander")
+        monthly = self.ledger.monthly_sums()
+        monthly_payee = self.ledger.monthly_sums("2016-07-15", "2016-07-15", payee="tåg varberg")
+
+        # Verify
+        self.assertEqual([("2016-06-28", "Jacob", 3729900, "skandia"),
+                          ("2016-06-29", "Tåg varberg", -28400, "skandia"),
+                          ("2016-06-30", "Kiosk", -2000, "santander")], june)
+        self.assertEqual(["2016-06-29", "2016-07-01"], [row[0] for row in payee])
+        self.assertEqual([("2016-06-30", "Kiosk", -2000, "santander")], santander)
+        self.assertEqual([("2016-06", 3, 3729900 - 28400 - 2000), ("2016-07", 1, -8400)], monthly)
+        self.assertEqual([("2016-07", 1, -8400)], monthly_payee)
+
+    def test_loading_again_replaces_statement(self):
+        # Setup
+        load_into_ledger(self.ledger, "skandia", self.skandia_file)
+        self.write_input(self.skandia_file, ["2016-06-28 \tJacob \t37 299,00 \t457 794,26\n"])
+
+        # Execute
+        count = load_into_ledger(self.ledger, "skandia", self.skandia_file)
+
+        # Verify
+        self.assertEqual(1, count)
+        self.assertEqual([("2016-06-28", "Jacob", 3729900, "skandia")], self.ledger.transactions())
+        self.assertEqual([("2016-06", 1, 3729900)], self.ledger.monthly_sums())
+
+    def test_stdin_loads_need_a_source_name(self):
+        # Setup
+        script_arguments = [sys.executable, SCRIPT, "ledger", self.ledger.file_name, "-", "--bank", "skandia"]
+        statements = {"june": "2016-06-28 \tJacob \t37 299,00 \t457 794,26\n",
+                      "july": "2016-07-01 \tTÅG VARBERG \t-84,00 \t455 781,49\n"}
+
+        # Execute
+        unnamed = subprocess.run(script_arguments, input=statements["june"], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True)
+        for source, statement in statements.items():
+            subprocess.run(script_arguments + ["--source", source], input=statement, stdout=subprocess.PIPE,
+                           universal_newlines=True, check=True)
+
+        # Verify
+        self.assertEqual(2, unnamed.returncode)
+        self.assertEqual(["2016-06-28", "2016-07-01"], [row[0] for row in self.ledger.transactions()])
+
+    def test_failed_load_changes_nothing(self):
+        # Setup
+        load_into_ledger(self.ledger, "skandia", self.skandia_file)
+        self.write_input(self.skandia_file, ["2016-06-28 \tJacob \t37 299,00 \t457 794,26\n", "Broken\n"])
+
+        # Execute
+        with self.assertRaises(Exception):
+            load_into_ledger(self.ledger, "skandia", self.skandia_file, batch_size=1)
+
+        # Verify
+        self.assertEqual(3, len(self.ledger.transactions()))
+
+
+class TestIncrementalConversion(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.directory, "statement.txt")
+        self.output_file = os.path.join(self.directory, "statement.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_input(self, lines):
+        with open(self.input_file, 'w') as f_input:
+            f_input.writelines(lines)
+
+    def read_output(self):
+        with open(self.output_file) as f_output:
+            return f_output.read()
+
+    def test_appends_only_new_lines(self):
+        # Setup
+        self.write_input(["2016-06-28 	Jacob 	37 299,00 	457 794,26\n",
+                          "2016-06-29 	Tåg varberg 	-284,00 	455 865,49\n"])
+        convert_file("skandia", self.input_file, incremental=True)
+        self.write_input(["2016-06-28 	Jacob 	37 299,00 	457 794,26\n",
+                          "2016-06-29 	Tåg varberg 	-284,00 	455 865,49\n",
+                          "2016-06-29 	Tåg varberg 	-284,00 	455 865,49\n",
+                          "2016-06-30 	Kiosk 	-20,00 	455 845,49\n"])
+
+        # Execute
+        convert_file("skandia", self.input_file, incremental=True)
+
+        # Verify
+        self.assertEqual("Date,Payee,Category,Memo,Outflow,Inflow\n"
+                         "28/06/2016,Jacob,,,,37299.00\n"
+                         "29/06/2016,Tåg varberg,,,284.00,\n"
+                         "29/06/2016,Tåg varberg,,,284.00,\n"
+                         "30/06/2016,Kiosk,,,20.00,\n", self.read_output())
+
+    def test_deleted_output_converts_every_line_again(self):
+        # Setup
+        self.write_input(["2016-06-28 	Jacob 	37 299,00 	457 794,26\n"])
+        convert_file("skandia", self.input_file, incremental=True)
+        os.remove(self.output_file)
+
+        # Execute
+        convert_file("skandia", self.input_file, incremental=True)
+
+        # Verify
+        self.assertEqual("Date,Payee,Category,Memo,Outflow,Inflow\n"
+                         "28/06/2016,Jacob,,,,37299.00\n", self.read_output())
+
+    def test_rejected_lines_are_tried_again(self):
+        # Setup
+        self.write_input(["2016-06-28 	Jacob 	37 299,00 	457 794,26\n",
+                          "2016-06-29 	Tåg varberg\n"])
+        rejected_file = self.output_file + ".rejected"
+        convert_file("skandia", self.input_file, incremental=True,
+                     rejected_lines=RejectedLines(rejected_file, max_error_rate=0.5))
+        rejected_lines = RejectedLines(rejected_file, max_error_rate=0.5)
+
+        # Execute
+        convert_file("skandia", self.input_file, incremental=True, rejected_lines=rejected_lines)
+        rejected_lines.close()
+
+        # Verify
+        self.assertEqual(1, rejected_lines.count)
+        self.assertEqual(FingerprintIndex.DIGEST_SIZE, os.path.getsize(self.output_file + FingerprintIndex.FILE_SUFFIX))
+
+    def test_existing_output_without_index_raises(self):
+        # Setup
+        self.write_input(["2016-06-28 	Jacob 	37 299,00 	457 794,26\n"])
+        convert_file("skandia", self.input_file)
+
+        # Execute / Verify
+        with self.assertRaises(ErrorOutputFileAlreadyExists):
+            convert_file("skandia", self.input_file, incremental=True)
+
+
+class TestTransactionDeduplicator(unittest.TestCase):
+
+    def convert(self, deduplicator, lines):
+        file_reader_spy = FileReaderSpy()
+        file_reader_spy.add_lines(lines)
+        file_writer_spy = FileWriterSpy()
+        statement_converter = StatementConverter(GeneralLineConverter("santander"), file_reader_spy,
+                                                 file_writer_spy, batch_size=2, deduplicator=deduplicator)
+        statement_converter.convert()
+        return file_writer_spy.lines[1:]
+
+    def test_drops_transactions_of_earlier_source(self):
+        # Setup
+        first_lines = []
+        first_lines.append("2017-02-12 	2017-04-01 	ITUNES.COM/BILL 	98 SEK 	-98 kr 	-552 kr")
+        first_lines.append("2017-02-13 	2017-04-01 	ITUNES.COM/BILL 	98 SEK 	-98 kr 	-650 kr")
+        second_lines = []
+        second_lines.append("2017-02-13 	2017-04-01 	ITUNES.COM/BILL 	98 SEK 	-98 kr 	-650 kr")
+        second_lines.append("2017-02-14 	2017-04-01 	ITUNES.COM/BILL 	98 SEK 	-98 kr 	-748 kr")
+        deduplicator = TransactionDeduplicator(capacity=100)
+        self.convert(deduplicator, first_lines)
+
+        # Execute
+        result = self.convert(deduplicator, second_lines)
+
+        # Verify
+        self.assertEqual(["14/02/2017,ITUNES.COM/BILL,,,98,\n"], result)
+        self.assertEqual(1, deduplicator.duplicates)
+
+    def test_keeps_identical_transactions_within_one_source(self):
+        # Setup
+        lines = []
+        lines.append("2017-02-12 	2017-04-01 	CAFE LUNDBY 	35 SEK 	-35 kr 	-552 kr")
+        lines.append("2017-02-12 	2017-04-01 	CAFE LUNDBY 	35 SEK 	-35 kr 	-587 kr")
+        overlapping_lines = lines + ["2017-02-12 	2017-04-01 	CAFE LUNDBY 	35 SEK 	-35 kr 	-622 kr"]
+        deduplicator = TransactionDeduplicator(capacity=100)
+
+        # Execute
+        first_result = self.convert(deduplicator, lines)
+        second_result = self.convert(deduplicator, overlapping_lines)
+
+        # Verify
+        self.assertEqual(["12/02/2017,CAFE LUNDBY,,,35,\n"] * 2, first_result)
+        self.assertEqual(["12/02/2017,CAFE LUNDBY,,,35,\n"], second_result)
+        self.assertEqual(2, deduplicator.duplicates)
+
+    def test_persisted_index(self):
+        # Setup
+        directory = tempfile.mkdtemp()
+        index_file = os.path.join(directory, "transactions.dedup")
+        deduplicator = TransactionDeduplicator(index_file, capacity=100)
+        deduplicator.is_duplicate("12/02/2017,ITUNES.COM/BILL,,,98,\n")
+        deduplicator.save()
+
+        # Execute
+        reloaded = TransactionDeduplicator(index_file)
+
+        # Verify
+        try:
+            self.assertTrue(reloaded.is_duplicate("12/02/2017,ITUNES.COM/BILL,,,98,\n"))
+            self.assertFalse(reloaded.is_duplicate("12/02/2017,ITUNES.COM/BILL,,,,98\n"))
+        finally:
+            shutil.rmtree(directory)
+
+
+    def test_filter_grows_when_saved(self):
+        # Setup
+        directory = tempfile.mkdtemp()
+        index_file = os.path.join(directory, "transactions.dedup")
+        lines = ["{:02d}/02/2017,Payee {},,,98,\n".format(day % 28 + 1, day) for day in range(1000)]
+        deduplicator = TransactionDeduplicator(index_file, capacity=10)
+        for line in lines:
+            deduplicator.is_duplicate(line)
+
+        # Execute
+        deduplicator.save()
+        reloaded = TransactionDeduplicator(index_file, capacity=10)
+
+        # Verify
+        try:
+            self.assertGreaterEqual(reloaded.capacity(), 2000)
+            self.assertEqual(1000, len(reloaded.known))
+            self.assertTrue(all(reloaded.is_duplicate(line) for line in lines))
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.directory, "statement.txt")
+        with open(self.input_file, 'w') as f_input:
+            f_input.write("2016-06-28 	Jacob 	37 299,00 	457 794,26\n")
+        self.result_cache = ResultCache(os.path.join(self.directory, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reuses_result_for_unchanged_input(self):
+        # Setup
+        first_output = os.path.join(self.directory, "first.csv")
+        second_output = os.path.join(self.directory, "second.csv")
+        convert_file("skandia", self.input_file, first_output, result_cache=self.result_cache)
+        key = self.result_cache.key(self.input_file, "skandia")
+
+        # Execute
+        restored = self.result_cache.restore(key, second_output)
+
+        # Verify
+        self.assertTrue(restored)
+        with open(first_output) as f_first, open(second_output) as f_second:
+            self.assertEqual(f_first.read(), f_second.read())
+
+    def test_cached_result_is_read_only(self):
+        # Setup
+        output_file = os.path.join(self.directory, "first.csv")
+
+        # Execute
+        convert_file("skandia", self.input_file, output_file, result_cache=self.result_cache)
+
+        # Verify
+        key = self.result_cache.key(self.input_file, "skandia")
+        self.assertEqual(0, os.stat(self.result_cache.path(key)).st_mode & 0o222)
+        self.assertNotEqual(0, os.stat(output_file).st_mode & 0o200)
+
+    def test_link_falls_back_to_copy_across_file_systems(self):
+        # Setup
+        result_cache = ResultCache(os.path.join(self.directory, "cache"), link=True)
+        result_cache.store("key", self.input_file)
+        output_file = os.path.join(self.directory, "restored.csv")
+        cross_device = OSError(errno.EXDEV, "Invalid cross-device link")
+
+        # Execute
+        with mock.patch.object(os, "link", side_effect=cross_device):
+            restored = result_cache.restore("key", output_file)
+
+        # Verify
+        self.assertTrue(restored)
+        self.assertNotEqual(os.stat(result_cache.path("key")).st_ino, os.stat(output_file).st_ino)
+        with open(self.input_file) as f_input, open(output_file) as f_output:
+            self.assertEqual(f_input.read(), f_output.read())
+
+    def test_key_depends_on_bank_and_content(self):
+        # Setup
+        key = self.result_cache.key(self.input_file, "skandia")
+
+        # Execute
+        other_bank_key = self.result_cache.key(self.input_file, "ica")
+        with open(self.input_file, 'a') as f_input:
+            f_input.write("2016-06-29 	Tåg varberg 	-284,00 	455 865,49\n")
+        changed_content_key = self.result_cache.key(self.input_file, "skandia")
+
+        # Verify
+        self.assertNotEqual(key, other_bank_key)
+        self.assertNotEqual(key, changed_content_key)
+
+    def test_evicts_least_recently_used(self):
+        # Setup
+        result_cache = ResultCache(os.path.join(self.directory, "small_cache"), max_size=60)
+        result_cache.store("old", self.input_file)
+        os.utime(result_cache.path("old"), (1, 1))
+
+        # Execute
+        result_cache.store("new", self.input_file)
+
+        # Verify
+        self.assertFalse(os.path.isfile(result_cache.path("old")))
+        self.assertTrue(os.path.isfile(result_cache.path("new")))
+
+
+class TestConversionServer(unittest.TestCase):
+
+    def request(self, request_bytes, idle_timeout=ConversionServer.DEFAULT_IDLE_TIMEOUT):
+        async def run():
+            server = await ConversionServer(max_connections=2, idle_timeout=idle_timeout).start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(request_bytes)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response
+
+        return asyncio.run(run())
+
+    def test_convert_upload(self):
+        # Setup
+        body = "2016-06-28 	Jacob 	37 299,00 	457 794,26\r\n2016-06-29 	Tåg varberg 	-284,00 	455 865,49".encode()
+        request_bytes = b"POST /convert?bank=skandia HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        expected_csv = "Date,Payee,Category,Memo,Outflow,Inflow\n28/06/2016,Jacob,,,,37299.00\n" \
+                       "29/06/2016,Tåg varberg,,,284.00,\n".encode()
+
+        # Execute
+        response = self.request(request_bytes)
+
+        # Verify
+        headers, _, chunked_body = response.partition(b"\r\n\r\n")
+        self.assertTrue(headers.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b"%x\r\n%s\r\n" % (len(expected_csv), expected_csv), chunked_body)
+        self.assertTrue(chunked_body.endswith(b"0\r\n\r\n"))
+
+    def test_expect_100_continue(self):
+        # Setup
+        body = "2016-06-28 	Jacob 	37 299,00 	457 794,26\n".encode()
+        request_bytes = b"POST /convert?bank=skandia HTTP/1.1\r\nContent-Length: %d\r\nExpect: 100-continue\r\n\r\n%s" \
+            % (len(body), body)
+
+        # Execute
+        response = self.request(request_bytes)
+
+        # Verify
+        self.assertTrue(response.startswith(b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK"))
+        self.assertIn(b"28/06/2016,Jacob,,,,37299.00\n", response)
+
+    def test_request_line_too_long(self):
+        # Execute
+        response = self.request(b"GET /" + b"x" * 100000 + b" HTTP/1.1\r\n\r\n")
+
+        # Verify
+        self.assertTrue(response.startswith(b"HTTP/1.1 431 Request Header Fields Too Large"))
+
+    def test_idle_clients_do_not_block_conversions(self):
+        # Setup
+        body = "2016-06-28 	Jacob 	37 299,00 	457 794,26\n".encode()
+
+        async def run():
+            server = await ConversionServer(max_connections=1).start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            idle_connection = await asyncio.open_connection("127.0.0.1", port)
+            idle_connection[1].write(b"POST /convert?bank=skandia HTTP/1.1\r\n")
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST /convert?bank=skandia HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            idle_connection[1].close()
+            server.close()
+            await server.wait_closed()
+            return response
+
+        # Execute
+        response = asyncio.run(run())
+
+        # Verify
+        self.assertIn(b"28/06/2016,Jacob,,,,37299.00\n", response)
+
+    def test_request_headers_time_out(self):
+        # Execute
+        response = self.request(b"POST /convert?bank=skandia HTTP/1.1\r\n", idle_timeout=0.1)
+
+        # Verify
+        self.assertTrue(response.startswith(b"HTTP/1.1 408 Request Timeout"))
+
+    def test_line_too_long(self):
+        # Setup
+        body = b"x" * (ConversionServer.MAX_LINE_SIZE + ConversionServer.READ_SIZE + 1)
+        request_bytes = b"POST /convert?bank=skandia HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s\n" % (len(body) + 1, body)
+
+        # Execute
+        response = self.request(request_bytes)
+
+        # Verify
+        self.assertTrue(response.startswith(b"HTTP/1.1 413 Payload Too Large"))
+
+    def test_invalid_bank(self):
+        # Execute
+        response = self.request(b"POST /convert?bank=nobank HTTP/1.1\r\nContent-Length: 0\r\n\r\n")
+
+        # Verify
+        self.assertTrue(response.startswith(b"HTTP/1.1 400 Bad Request"))
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_does_not_load_mode_specific_modules(self):
+        # Setup
+        mode_specific_modules = ["argparse", "asyncio", "concurrent.futures", "json", "mmap", "numpy"]
+        code = "import sys, parsebankstatement; print(' '.join(sorted(sys.modules)))"
+
+        # Execute
+        loaded_modules = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(SCRIPT),
+                                                 universal_newlines=True).split()
+
+        # Verify
+        for module in mode_specific_modules:
+            self.assertNotIn(module, loaded_modules)
+
+    def test_launcher_converts_like_script(self):
+        # Setup
+        launcher = os.path.join(os.path.dirname(SCRIPT), "parsebankstatement_cli.py")
+        statement = "2016-06-28 	Jacob 	37 299,00 	457 794,26\n"
+
+        # Execute
+        completed = subprocess.run([sys.executable, launcher, "skandia", "-"], input=statement,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+        # Verify
+        self.assertEqual("Date,Payee,Category,Memo,Outflow,Inflow\n28/06/2016,Jacob,,,,37299.00\n", completed.stdout)
+
+
+class TestStdioStreaming(unittest.TestCase):
+    def setUp(self):
+        self.lines = ["2017-08-22 \t2017-08-22 \tITUNES.COM/BILL \t0 \t-99,00 kr \t1 000,00 kr\n",
+                      "2017-08-21 \t2017-08-21 \tCAFE LUNDBY \t0 \t-45,50 kr \t1 099,00 kr\n"]
+        self.expected_output = ("Date,Payee,Category,Memo,Outflow,Inflow\n"
+                                "22/08/2017,ITUNES.COM/BILL,,,99.00,\n"
+                                "21/08/2017,CAFE LUNDBY,,,45.50,\n")
+
+    def run_cli(self, arguments):
+        return subprocess.run([sys.executable, SCRIPT] + arguments, input="".join(self.lines),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    def test_stdin_to_stdout_keeps_csv_clean(self):
+        # Execute
+        completed = self.run_cli(["santander", "-", "-", "--stats"])
+
+        # Verify
+        self.assertEqual(self.expected_output, completed.stdout)
+        self.assertIn("Input file.: -", completed.stderr)
+        self.assertIn("Lines......: 2", completed.stderr)
+
+    def test_stdin_defaults_to_stdout(self):
+        # Execute
+        completed = self.run_cli(["santander", "-", "--workers", "4", "--mmap"])
+
+        # Verify
+        self.assertEqual(self.expected_output, completed.stdout)
+
+    def test_output_file_name_for_stdin_is_stdout(self):
+        # Execute
+        result = OutputFileName().create_output_file_name("-")
+
+        # Verify
+        self.assertEqual("-", result)
+
+
 class TestOutputFileName(unittest.TestCase):
 
     def test_passing(self):